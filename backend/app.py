@@ -9,12 +9,40 @@ from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import xml.etree.ElementTree as ET
 import re
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import as_completed
 from dotenv import load_dotenv
-from test import fetch_and_parse_regulations
-from weather_runway import get_metar_avwx
+from cfr_ingest import ingest_cfr_parts, parse_targets, targets_key, IngestError
+from weather_runway import get_metar_avwx, get_metars, bucket_metar, metar_cache_info, load_metar_cycle
+from regulation_store import load_or_build, snapshot_dir
+from vector_index import make_index, load_or_build_index
+from chunking import group_by_parent, merge_sections
+from embedding_batcher import EmbeddingBatcher
+from query_cache import QueryCache
+from keyword_index import BM25Index, reciprocal_rank_fusion
+from response_cache import ResponseCache, canonical_key
+from timing import StageTimer
+from streaming import sse, event_stream, chunk_text, JsonSectionParser
+from chat_sessions import ChatSessionStore, FirestoreSessionBackend
+from job_queue import JobQueue, TokenBucket, GEMINI_RPM
+from schedule_batch import (parse_schedule, normalize_leg, leg_key, read_checkpoint, ResultWriter,
+                            BatchProgress, LEG_FIELDS)
+from token_budget import TokenStats, pack_sections, CONTEXT_TOKEN_BUDGET
+from reranker import Reranker, RERANK_CANDIDATES
+from firestore_store import FirestoreStore, MemoryFirestore, start_request_count, request_round_trips
+from concurrent.futures import ThreadPoolExecutor
+from ingest import (diff_regulations, load_ingest_state, write_changes, change_log_entry, apply_index_changes,
+                    REGULATION_SCHEMA_VERSION)
+from regulation_index import RegulationIndex
+from change_feed import (ChangeFeed, firestore_page, normalize_dates, parse_since, backfill_effective_at,
+                         decode_cursor as decode_feed_cursor, FEED_PAGE_SIZE, FEED_MAX_PAGE_SIZE)
 # Load environment variables
 env_path = os.path.join(os.path.dirname(__file__), "..", ".env.local")
 
@@ -22,7 +50,24 @@ env_path = os.path.join(os.path.dirname(__file__), "..", ".env.local")
 load_dotenv(env_path)
 
 app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000"]}})
+CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000"]}}, expose_headers=["Server-Timing", "X-Firestore-Round-Trips", "ETag", "X-Next-Cursor"])
+
+# Shared pools: I/O fan-out inside a request, and fire-and-forget writes off the response path
+io_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("IO_POOL_SIZE", 16)), thread_name_prefix="io")
+background_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="background")
+# CPU-bound embedding/FAISS work is offloaded here so async views never block on it
+cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="cpu")
+
+async def run_blocking(fn, *args, pool=None):
+    """
+    Runs a blocking call in a thread pool (the I/O pool by default) and awaits its result.
+    Gemini is called this way too: Flask runs each async view on a fresh event loop, and the
+    SDK's *_async methods cache a grpc-asyncio client bound to the first request's loop.
+    """
+    loop = asyncio.get_running_loop()
+    # Carry the request context (e.g. the Firestore round-trip counter) into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(pool or io_pool, functools.partial(context.run, fn, *args))
 service_account_info = {
     "type": "service_account",
     "project_id": os.environ.get("GOOGLE_PROJECT_ID"),
@@ -37,14 +82,28 @@ service_account_info = {
     "universe_domain": "googleapis.com"
 }
 # Initialize Firebase (in production, use environment variables)
-try:
-    cred = credentials.Certificate(service_account_info)
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-except Exception as e:
-    print(f"Firebase initialization error: {e}")
-    print("Using mock data instead")
-    db = None
+if os.environ.get("FIRESTORE_BACKEND") == "memory":
+    # In-process stand-in for tests and benchmarks without a Firebase project
+    db = MemoryFirestore()
+else:
+    try:
+        cred = credentials.Certificate(service_account_info)
+        firebase_admin.initialize_app(cred)
+        db = firestore.client()
+    except Exception as e:
+        print(f"Firebase initialization error: {e}")
+        print("Using mock data instead")
+        db = None
+store = FirestoreStore(db) if db else None
+
+@app.before_request
+def count_firestore_round_trips():
+    start_request_count()
+
+@app.after_request
+def report_firestore_round_trips(response):
+    response.headers["X-Firestore-Round-Trips"] = str(request_round_trips())
+    return response
 
 # Initialize Gemini AI
 api_key = os.environ.get("GEMINI_API_KEY", "your-api-key")
@@ -55,17 +114,33 @@ if api_key != "your-api-key":
 else:
     model = None
     print("Warning: GEMINI_API_KEY not set. AI features will be limited.")
+# Shared by background and batch Gemini calls so together they stay within the quota
+gemini_bucket = TokenBucket(GEMINI_RPM / 60.0)
+# Prompt/response tokens of every Gemini call, per endpoint
+token_stats = TokenStats()
 
 # Initialize FAISS and SentenceTransformer
 try:
     encoder = SentenceTransformer('all-MiniLM-L6-v2')
     vector_dimension = 384  # Dimension of the embeddings from the model
-    index = faiss.IndexFlatL2(vector_dimension)
+    # flat (exact), hnsw or ivfpq; the real index is built or loaded with the regulations
+    index_type = os.environ.get("INDEX_TYPE", "flat")
+    # Ids are row numbers in `regulations` so changed rows can be replaced in place
+    index = make_index("flat", vector_dimension)
+    # Query embeddings from concurrent requests are encoded together in micro-batches
+    embedder = EmbeddingBatcher(encoder)
+    # Normalized query -> embedding and (embedding, k, index version) -> passage rows
+    query_cache = QueryCache()
+    # Optional second stage: a cross-encoder re-ranks a wider candidate set (RERANK_ENABLED=1)
+    reranker = Reranker() if os.environ.get("RERANK_ENABLED") else None
 except Exception as e:
     print(f"FAISS initialization error: {e}")
     print("Vector search will be limited")
     encoder = None
     index = None
+    embedder = None
+    reranker = None
+    query_cache = None
 
 # Aircraft data with Gulfstream 550 prioritized
 aircraft_data = [
@@ -121,8 +196,27 @@ aircraft_data = [
     }
 ]
 
+# Change log of the most recent regulation ingest, surfaced by /api/fetch-faa-updates
+regulation_changes = {}
+# Local sorted index of regulations by amendment date, used when running without Firestore
+change_feed = ChangeFeed([])
+# Category / aircraft type inverted indexes behind /api/regulations
+regulation_index = RegulationIndex()
+if store:
+    # Kept current from the snapshot listener's document changes, without re-reading the collection
+    store.on_regulation_changes(regulation_index.update)
+    # Documents written by anything other than the ingest get their feed timestamp as they arrive
+    store.on_regulation_changes(lambda upserted, removed: backfill_effective_at(store, upserted))
+# Paragraph-level passages of the regulations; FAISS ids are rows in this list
+passages = []
+regulations_by_id = {}
+# Identifies the corpus and index that cached retrieval results belong to
+index_version = None
+# BM25 inverted index over passages (hybrid RAG); keyword search of sections lives in regulation_index
+passage_keyword_index = None
+
 # Load FAA regulations data
-def load_faa_regulations():
+def load_faa_regulations(previous_regulations=None, previous_passages=None, ecfr_date=None):
     # In a real implementation, this would load from a database or API
     # For demo purposes, we'll use a small sample with focus on Gulfstream 550
     # regulations = [
@@ -151,33 +245,134 @@ def load_faa_regulations():
            
     #     }
     # ]
-    regulations = []
-    url = 'https://www.ecfr.gov/api/renderer/v1/content/enhanced/2025-03-12/title-14?chapter=I&subchapter=G&part=135'
-    regulations += fetch_and_parse_regulations(url)
-    print(regulations)
-    # Store in Firebase if available
+    # Targets are "title:part[:date]" entries, e.g. ECFR_TARGETS="14:91,14:91K,14:135,14:121"
+    # A refresh may pass a newer `ecfr_date` for the targets that don't pin their own
+    targets = parse_targets(os.environ.get("ECFR_TARGETS", "14:135"), ecfr_date or os.environ.get("ECFR_DATE", "2025-03-12"))
+    ecfr_date = targets_key(targets)
+
+    # Load the on-disk snapshot if we have one, otherwise scrape eCFR and re-encode only changed sections.
+    # A failed target raises IngestError before anything is diffed, written or swapped, so a
+    # partial fetch can't read as "every other section was removed"
+    global regulations_by_id
+    regulations, new_passages, embeddings, fresh = load_or_build(ecfr_date, lambda: ingest_cfr_parts(targets), encoder)
+    if not regulations:
+        raise IngestError(f"No regulations for {ecfr_date}")
+    regulations_by_id = {r['id']: r for r in regulations}
+    # Amendment dates become real timestamps here, so the change feed can range-query them
+    normalize_dates(regulations)
+    global change_feed
+    change_feed = ChangeFeed(regulations)
+
+    new_keyword_index = BM25Index(new_passages)
+    print(f"Loaded {len(regulations)} regulations, {len(new_passages)} passages ({'fetched' if fresh else 'from snapshot'})")
+
+    # Diff against the hashes stored by the last ingest and only write what changed
+    global regulation_changes
+    if db:
+        state = load_ingest_state(db)
+        previous_hashes = state.get("hashes", {})
+        # Sections written before `effective_at` existed are rewritten once to backfill it
+        rewrite_all = state.get("schema_version") != REGULATION_SCHEMA_VERSION
+    else:
+        previous_hashes = {r['id']: r.get('hash') for r in previous_regulations or []}
+    changes = diff_regulations(previous_hashes, regulations)
     if db:
-        for reg in regulations:
-            db.collection('regulations').document(reg['id']).set(reg)
+        commits = write_changes(db, regulations, changes, ecfr_date, rewrite_all)
+        print(f"Regulation ingest: {len(changes['added'])} added, {len(changes['modified'])} modified, "
+              f"{len(changes['removed'])} removed in {commits} batched commits")
+    regulation_changes = change_log_entry(changes, ecfr_date)
+
+    # Firestore can hold documents the eCFR ingest doesn't produce (aircraft-specific circulars),
+    # so with a database the index is built from the collection; later writes arrive via the listener
+    if store:
+        stored = store.regulations()
+        backfilled = backfill_effective_at(store, stored)
+        if backfilled:
+            print(f"Backfilled effective_at on {backfilled} stored regulations")
+        regulation_index.rebuild(stored)
+    elif previous_regulations is not None:
+        regulation_index.apply_changes(regulations, changes)
+    else:
+        regulation_index.rebuild(regulations)
     
-    # Create FAISS index if available
-    if encoder and index:
-        texts = [f"{r['id']} {r['title']} {r['content']}" for r in regulations]
-        embeddings = encoder.encode(texts)
-        
-        if index.ntotal > 0:
-            index.reset()
-        index.add(np.array(embeddings).astype('float32'))
+    # Load the persisted FAISS index on startup; on a refresh touch only the affected rows when possible
+    global index, index_version, passages, passage_keyword_index
+    new_index = index
+    if encoder and index and embeddings is not None:
+        if index.ntotal == 0:
+            new_index = load_or_build_index(index_type, embeddings, snapshot_dir(ecfr_date))
+        else:
+            # Changes go into a copy, so searches running during a refresh keep a consistent index
+            new_index = faiss.clone_index(index)
+            previous_passages = previous_passages or []
+            passage_changes = diff_regulations({p['id']: p.get('hash') for p in previous_passages}, new_passages)
+            apply_index_changes(new_index, previous_passages, new_passages, embeddings, passage_changes)
+
+    # FAISS ids and BM25 rows are rows of `passages`, so the three are swapped in together
+    passages, passage_keyword_index, index = new_passages, new_keyword_index, new_index
+    if encoder and index and embeddings is not None:
+        index_version = f"{os.path.basename(snapshot_dir(ecfr_date) or ecfr_date)}:{index_type}"
+        query_cache.invalidate()
     
     return regulations
 
 # Initialize regulations
-regulations = load_faa_regulations()
+try:
+    regulations = load_faa_regulations()
+except IngestError as e:
+    # Start without a local corpus; the stored regulations are left as they are
+    print(f"Regulation ingest failed: {e}")
+    regulations = []
+    if store:
+        regulation_index.rebuild(store.regulations())
+
+refresh_lock = threading.Lock()
+
+def refresh_regulations(ecfr_date=None):
+    """
+    Re-ingests the corpus, e.g. for a newer eCFR date, against the one being served: only
+    changed sections are written and re-embedded, and only changed FAISS rows are replaced.
+    If any eCFR target fails, the corpus being served stays in place.
+    Returns the change log, or None if a refresh is already running or failed.
+    """
+    global regulations
+    if not refresh_lock.acquire(blocking=False):
+        return None
+    try:
+        regulations = load_faa_regulations(regulations, passages, ecfr_date)
+        print(f"Regulation refresh: {len(regulation_changes['added'])} added, "
+              f"{len(regulation_changes['modified'])} modified, {len(regulation_changes['removed'])} removed")
+        return regulation_changes
+    except Exception as e:
+        print(f"Regulation refresh failed: {e}")
+        return None
+    finally:
+        refresh_lock.release()
 
 # API Routes
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy", "message": "Flinsight API is running"})
+    health = {"status": "healthy", "message": "Flinsight API is running"}
+    if embedder:
+        health["embedding_batcher"] = embedder.stats()
+    if query_cache:
+        health["query_cache"] = query_cache.stats()
+    health["analysis_cache"] = analysis_cache.stats()
+    health["metar_cache"] = metar_cache_info()
+    health["regulation_index"] = regulation_index.stats()
+    if store:
+        health["firestore"] = store.stats()
+    health["chat_sessions"] = chat_sessions.stats()
+    health["llm_tokens"] = token_stats.summary()
+    if reranker:
+        health["reranker"] = reranker.stats()
+    health["faa_update_jobs"] = faa_update_jobs.progress()
+    return jsonify(health)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-endpoint prompt and response token histograms in the Prometheus text format."""
+    return token_stats.prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4"}
 
 @app.route('/api/aircraft', methods=['GET'])
 def get_aircraft():
@@ -190,6 +385,22 @@ class responseSchema(typing.TypedDict):
     required_actions: list[str]
     compliance_risks: list[str]
 
+# Bump when the analyze-flight prompts change so cached responses are not re-used
+RISK_PROMPT_VERSION = 1
+ANALYSIS_PROMPT_VERSION = 2
+# Gemini responses for /api/analyze-flight, keyed by flight details, bucketed weather and regulations
+analysis_cache = ResponseCache()
+
+def store_in_background(collection, record):
+    """Writes a document without blocking the response; failures are only logged."""
+    def write():
+        try:
+            store.add(collection, record)
+        except Exception as e:
+            print(f"Error writing to {collection}: {e}")
+    if db:
+        background_pool.submit(write)
+
 def get_from_metar(metar_data):
     observation_time = metar_data.get("time", {}).get("dt", "N/A")
     temperature = metar_data.get("temperature", {}).get("value", "N/A")
@@ -199,27 +410,101 @@ def get_from_metar(metar_data):
     return f"observation time: {observation_time}, temperature: {temperature} C, wind speed: {wind_speed} knots, wind direction: {wind_dir}, visibility: {visibility}"
 
 @app.route('/api/weather_at', methods=['POST'])
-def weather_at():
+async def weather_at():
     data = request.json
     departure = data.get('departure', '')
     arrival = data.get('arrival', '')
-    metar_data1 = get_from_metar(get_metar_avwx(departure)) 
-    metar_data2 = get_from_metar(get_metar_avwx(arrival)) 
+    metars = await run_blocking(get_metars, [departure, arrival])
+    metar_data1 = get_from_metar(metars.get(departure.strip().upper()))
+    metar_data2 = get_from_metar(metars.get(arrival.strip().upper()))
     return jsonify({"departure": metar_data1, "arrival": metar_data2})
 
-@app.route('/api/analyze-flight', methods=['POST'])
-def analyze_flight():
-    data = request.json
-  
-    # Extract flight details
-    departure = data.get('departure', '')
-    arrival = data.get('arrival', '')
-    aircraft = data.get('aircraft', '')
-    date = data.get('date', '')
-    passengers = data.get('passengers', 0)
-    
-    # Create flight context for AI
-    flight_context2 = f"""
+@app.route('/api/weather_bulk', methods=['POST'])
+def weather_bulk():
+    """Parsed METAR summaries for many stations (departures, arrivals, alternates, en-route points) in one call."""
+    data = request.json or {}
+    stations = []
+    for key in ('stations', 'alternates', 'enroute'):
+        stations.extend(data.get(key) or [])
+    if not stations:
+        return jsonify({"status": "error", "message": "No stations provided"}), 400
+
+    metars = get_metars(stations)
+    return jsonify({
+        "status": "success",
+        "weather": {station: get_from_metar(metar) if metar else None for station, metar in metars.items()},
+        "missing": [station for station, metar in metars.items() if not metar]
+    })
+
+def scheduled_stations(day):
+    """Departure and arrival stations of the flights analyzed for `day` (YYYY-MM-DD)."""
+    if not db:
+        return []
+    stations = set()
+    try:
+        for flight in store.query('flight_analyses', [('date', '==', day)]):
+            stations.update(s for s in (flight.get('departure'), flight.get('arrival')) if s)
+    except Exception as e:
+        print(f"Error reading scheduled flights: {e}")
+    return sorted(stations)
+
+def prefetch_weather(stations=None):
+    """Warms the METAR cache for the given stations, or for tomorrow's scheduled flights."""
+    if stations is None:
+        stations = scheduled_stations((datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d'))
+    metars = get_metars(stations)
+    print(f"Prefetched weather for {len(metars)} stations")
+    return metars
+
+@app.route('/api/regulations/refresh', methods=['POST'])
+def regulations_refresh():
+    """Starts a background re-ingest; {"ecfr_date": "2025-06-01"} moves the corpus to a newer eCFR date."""
+    data = request.get_json(silent=True) or {}
+    if data.get('ecfr_date'):
+        try:
+            datetime.strptime(data['ecfr_date'], '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "ecfr_date must be YYYY-MM-DD"}), 400
+    if refresh_lock.locked():
+        return jsonify({"status": "error", "message": "A refresh is already running"}), 409
+    background_pool.submit(refresh_regulations, data.get('ecfr_date'))
+    return jsonify({"status": "accepted"}), 202
+
+@app.route('/api/weather_prefetch', methods=['POST'])
+def weather_prefetch():
+    data = request.json or {}
+    background_pool.submit(prefetch_weather, data.get('stations'))
+    return jsonify({"status": "accepted"}), 202
+
+def _prefetch_loop(interval):
+    while True:
+        try:
+            prefetch_weather()
+        except Exception as e:
+            print(f"Weather prefetch failed: {e}")
+        time.sleep(interval)
+
+# Optional scheduled prefetch of tomorrow's stations, e.g. WEATHER_PREFETCH_INTERVAL=1800
+if os.environ.get("WEATHER_PREFETCH_INTERVAL"):
+    threading.Thread(target=_prefetch_loop, args=(float(os.environ["WEATHER_PREFETCH_INTERVAL"]),),
+                     name="weather-prefetch", daemon=True).start()
+
+def _metar_cycle_loop(interval):
+    while True:
+        try:
+            print(f"Loaded {load_metar_cycle()} METARs from the NOAA cycle file")
+        except Exception as e:
+            print(f"METAR cycle load failed: {e}")
+        time.sleep(interval)
+
+# Optional bulk seeding of the METAR cache from NOAA's hourly cycle file, e.g. METAR_CYCLE_INTERVAL=600;
+# stations it covers are then served without a per-station AVWX call
+if os.environ.get("METAR_CYCLE_INTERVAL"):
+    threading.Thread(target=_metar_cycle_loop, args=(float(os.environ["METAR_CYCLE_INTERVAL"]),),
+                     name="metar-cycle", daemon=True).start()
+
+def flight_details_text(departure, arrival, aircraft, date, passengers):
+    return f"""
     Flight Details:
     - Departure: {departure}
     - Arrival: {arrival}
@@ -228,40 +513,17 @@ def analyze_flight():
     - Passengers: {passengers}
     """
 
-    metar_data1 = f"information at {departure}: ```" + get_from_metar(get_metar_avwx(departure)) + "```"
-    metar_data2 = f"information at {arrival}: ```" + get_from_metar(get_metar_avwx(arrival)) + "```"
-    flight_context = model2.generate_content(f"Given the flight context, come up with the top compliance risks that a new operator might miss (focus on aspects of the flight that are different than a standard one, example: international, overwater, icing, etc.). Flight context: {flight_context2}\n{metar_data1}\n{metar_data2}").text
-            
-    # Find if this is a Gulfstream 550 flight
-    is_g550 = "gulfstream" in aircraft.lower() and "550" in aircraft
-    
-    # Query FAISS for relevant regulations if available
-    if encoder and index:
-        query_embedding = encoder.encode([flight_context])
-        distances, indices = index.search(np.array(query_embedding).astype('float32'), 5)
-        
-        relevant_regs = [regulations[idx] for idx in indices[0]]
-        print(relevant_regs)
-    else:
-        # Without FAISS, filter manually with prioritization for G550
-        if is_g550:
-            relevant_regs = [r for r in regulations if 'aircraft_types' in r and 'GLF5' in r['aircraft_types']]
-            # Add some general regulations if we don't have enough G550-specific ones
-            if len(relevant_regs) < 3:
-                general_regs = [r for r in regulations if 'aircraft_types' not in r]
-                relevant_regs.extend(general_regs[:3-len(relevant_regs)])
-        else:
-            relevant_regs = [r for r in regulations if 'aircraft_types' not in r][:3]
-    
-    # Use Gemini to generate contextual insights
-    if model:
-        prompt = f"""
+def risk_prompt(flight_context2, metar_data1, metar_data2):
+    return f"Given the flight context, come up with the top compliance risks that a new operator might miss (focus on aspects of the flight that are different than a standard one, example: international, overwater, icing, etc.). Flight context: {flight_context2}\n{metar_data1}\n{metar_data2}"
+
+def analysis_prompt(flight_context2, relevant_regs):
+    return f"""
         As an aviation compliance AI assistant, analyze this flight plan:
         
         {flight_context2}
         
-        Based on these potentially relevant regulations:
-        {json.dumps(relevant_regs, indent=2)}
+        Based on these potentially relevant regulations, one per line as [id] title: text:
+        {pack_regulations(relevant_regs)[0]}
         
         Provide:
         1. applicable_regulations: Which regulations (exact id number) pecifically apply to this flight (based on the unique, less common aspects of the flight, ex: international, overwater, icing)
@@ -273,47 +535,134 @@ def analyze_flight():
         Ensure your response is concise and contains all the necessary information.
        
         """
+
+def is_g550(aircraft):
+    return "gulfstream" in aircraft.lower() and "550" in aircraft
+
+def fallback_regulations(aircraft):
+    """Without FAISS, filter manually with prioritization for G550"""
+    if is_g550(aircraft):
+        relevant_regs = [r for r in regulations if 'aircraft_types' in r and 'GLF5' in r['aircraft_types']]
+        # Add some general regulations if we don't have enough G550-specific ones
+        if len(relevant_regs) < 3:
+            general_regs = [r for r in regulations if 'aircraft_types' not in r]
+            relevant_regs.extend(general_regs[:3-len(relevant_regs)])
+        return relevant_regs
+    return [r for r in regulations if 'aircraft_types' not in r][:3]
+
+def mock_analysis(aircraft, relevant_regs):
+    """Without Gemini, provide mock analysis"""
+    if is_g550(aircraft):
+        return {
+            "applicable_regulations": [
+                "AC GLF5-2025-01: Gulfstream 550 RVSM Operations",
+                "LOI 2025-G550-01: Gulfstream 550 MEL Requirements",
+                "AC 135-12B: Oxygen Mask Inspection"
+            ],
+            "required_actions": [
+                "Verify altimeter testing is current for RVSM operations",
+                "Ensure MEL compliance for international operations",
+                "Confirm oxygen masks have been inspected within the last 90 days"
+            ],
+            "compliance_risks": [
+                "Non-compliance with RVSM requirements could result in routing restrictions",
+                "Outdated MEL items may cause operational delays",
+                "Oxygen system deficiencies may restrict high-altitude operations"
+            ]
+        }
+    return fallback_analysis(relevant_regs)
+
+def fallback_analysis(relevant_regs):
+    return {
+        "applicable_regulations": [r["id"] + ": " + r["title"] for r in relevant_regs],
+        "required_actions": ["Verify compliance with " + r["title"] for r in relevant_regs],
+        "compliance_risks": ["Potential non-compliance with " + r["title"] for r in relevant_regs]
+    }
+
+@app.route('/api/analyze-flight', methods=['POST'])
+async def analyze_flight():
+    data = request.json
+  
+    # Extract flight details
+    departure = data.get('departure', '')
+    arrival = data.get('arrival', '')
+    aircraft = data.get('aircraft', '')
+    date = data.get('date', '')
+    passengers = data.get('passengers', 0)
+    
+    # Create flight context for AI
+    flight_context2 = flight_details_text(departure, arrival, aircraft, date, passengers)
+
+    timer = StageTimer()
+    # Both METARs are fetched in parallel
+    metar1, metar2 = await asyncio.gather(
+        timer.measure("metar_departure", run_blocking(get_metar_avwx, departure)),
+        timer.measure("metar_arrival", run_blocking(get_metar_avwx, arrival))
+    )
+    metar_data1 = f"information at {departure}: ```" + get_from_metar(metar1) + "```"
+    metar_data2 = f"information at {arrival}: ```" + get_from_metar(metar2) + "```"
+
+    # Retrieval on the raw flight context runs alongside the risk-summary call
+    raw_retrieval = None
+    if encoder and index:
+        raw_retrieval = asyncio.ensure_future(timer.measure("retrieval_raw", run_blocking(
+            get_relevant_regulations, f"{flight_context2}\n{metar_data1}\n{metar_data2}", 5, pool=cpu_pool)))
+
+    # Re-use the risk summary for the same flight in similar weather
+    flight_key = [departure.strip().upper(), arrival.strip().upper(), aircraft.strip().lower(), date, passengers]
+    risk_key = canonical_key("risks", RISK_PROMPT_VERSION, flight_key, bucket_metar(metar1), bucket_metar(metar2))
+    risk_scope = tuple(flight_key[:3])
+    risk_vector = None
+    with timer.stage("risks"):
+        if query_cache and analysis_cache.similarity is not None:
+            risk_vector = await run_blocking(query_cache.embedding, f"{flight_context2}\n{metar_data1}\n{metar_data2}",
+                                             lambda q: embedder.encode([q])[0], pool=cpu_pool)
+        flight_context = analysis_cache.get(risk_key, risk_vector, risk_scope)
+        if flight_context is None:
+            prompt = risk_prompt(flight_context2, metar_data1, metar_data2)
+            try:
+                response = await run_blocking(model2.generate_content, prompt)
+                token_stats.record("analyze-flight/risks", prompt, response)
+                flight_context = response.text
+                analysis_cache.put(risk_key, flight_context, risk_vector, risk_scope)
+            except Exception as e:
+                print(f"Error with Gemini API: {e}")
+                # Retrieve with the flight details alone rather than failing the request
+                flight_context = flight_context2
+            
+    # Query FAISS for relevant regulations if available
+    if encoder and index:
+        with timer.stage("retrieval"):
+            risk_regs = await run_blocking(get_relevant_regulations, flight_context, 5, pool=cpu_pool)
+            relevant_regs = merge_sections([risk_regs, await raw_retrieval], 5)
+        print([r['id'] for r in relevant_regs])
+    else:
+        relevant_regs = fallback_regulations(aircraft)
+    
+    # Use Gemini to generate contextual insights
+    if model:
+        prompt = analysis_prompt(flight_context2, relevant_regs)
         
+        analysis_key = canonical_key("analysis", ANALYSIS_PROMPT_VERSION, flight_key, [r["id"] for r in relevant_regs])
         try:
-            response = model.generate_content(prompt, generation_config=genai.GenerationConfig(response_mime_type="application/json",
-                                                response_schema = responseSchema))
-            print(response.text)
-            ai_analysis = json.loads(response.text)
+            ai_analysis = analysis_cache.get(analysis_key)
+            if ai_analysis is None:
+                with timer.stage("analysis"):
+                    response = await run_blocking(functools.partial(
+                        model.generate_content, prompt,
+                        generation_config=genai.GenerationConfig(response_mime_type="application/json",
+                                                                 response_schema=responseSchema)))
+                token_stats.record("analyze-flight/analysis", prompt, response)
+                print(response.text)
+                ai_analysis = json.loads(response.text)
+                analysis_cache.put(analysis_key, ai_analysis)
         except Exception as e:
             print(f"Error with Gemini API: {e}")
             # Fallback response if AI fails
-            ai_analysis = {
-                "applicable_regulations": [r["id"] + ": " + r["title"] for r in relevant_regs],
-                "required_actions": ["Verify compliance with " + r["title"] for r in relevant_regs],
-                "compliance_risks": ["Potential non-compliance with " + r["title"] for r in relevant_regs]
-            }
+            ai_analysis = fallback_analysis(relevant_regs)
         # for i in range(len(ai_analysis["applicable_regulations"]))
     else:
-        # Without Gemini, provide mock analysis
-        if is_g550:
-            ai_analysis = {
-                "applicable_regulations": [
-                    "AC GLF5-2025-01: Gulfstream 550 RVSM Operations",
-                    "LOI 2025-G550-01: Gulfstream 550 MEL Requirements",
-                    "AC 135-12B: Oxygen Mask Inspection"
-                ],
-                "required_actions": [
-                    "Verify altimeter testing is current for RVSM operations",
-                    "Ensure MEL compliance for international operations",
-                    "Confirm oxygen masks have been inspected within the last 90 days"
-                ],
-                "compliance_risks": [
-                    "Non-compliance with RVSM requirements could result in routing restrictions",
-                    "Outdated MEL items may cause operational delays",
-                    "Oxygen system deficiencies may restrict high-altitude operations"
-                ]
-            }
-        else:
-            ai_analysis = {
-                "applicable_regulations": [r["id"] + ": " + r["title"] for r in relevant_regs],
-                "required_actions": ["Verify compliance with " + r["title"] for r in relevant_regs],
-                "compliance_risks": ["Potential non-compliance with " + r["title"] for r in relevant_regs]
-            }
+        ai_analysis = mock_analysis(aircraft, relevant_regs)
     
     # Store analysis in Firebase
     flight_record = {
@@ -326,10 +675,10 @@ def analyze_flight():
         "timestamp": firestore.SERVER_TIMESTAMP if db else datetime.now().isoformat()
     }
     
-    if db:
-        db.collection('flight_analyses').add(flight_record)
+    # The write happens after the response is sent
+    store_in_background('flight_analyses', flight_record)
     
-    return jsonify({
+    response = jsonify({
         "flight_details": {
             "departure": departure,
             "arrival": arrival,
@@ -339,146 +688,482 @@ def analyze_flight():
         },
         "analysis": ai_analysis
     })
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+ANALYSIS_SECTIONS = ["applicable_regulations", "compliance_risks", "required_actions"]
+
+@app.route('/api/analyze-flight/stream', methods=['POST'])
+def analyze_flight_stream():
+    """
+    Server-Sent Events version of /api/analyze-flight. Emits `weather`, streamed `risks` text,
+    `regulations` (for citations), then each analysis section as soon as Gemini finishes it,
+    and finally `done` with the full analysis and stage timings (including time to first event).
+    """
+    data = request.json
+    departure = data.get('departure', '')
+    arrival = data.get('arrival', '')
+    aircraft = data.get('aircraft', '')
+    date = data.get('date', '')
+    passengers = data.get('passengers', 0)
+    timer = StageTimer()
+
+    def events():
+        flight_context2 = flight_details_text(departure, arrival, aircraft, date, passengers)
+        with timer.stage("metar"):
+            metars = get_metars([departure, arrival])
+        metar1 = metars.get(departure.strip().upper())
+        metar2 = metars.get(arrival.strip().upper())
+        metar_data1 = f"information at {departure}: ```" + get_from_metar(metar1) + "```"
+        metar_data2 = f"information at {arrival}: ```" + get_from_metar(metar2) + "```"
+        timer.mark("first_event")
+        yield sse("weather", {"departure": get_from_metar(metar1), "arrival": get_from_metar(metar2)})
+
+        flight_key = [departure.strip().upper(), arrival.strip().upper(), aircraft.strip().lower(), date, passengers]
+        risk_key = canonical_key("risks", RISK_PROMPT_VERSION, flight_key, bucket_metar(metar1), bucket_metar(metar2))
+        flight_context = analysis_cache.get(risk_key)
+        if flight_context is None and model:
+            parts = []
+            prompt = risk_prompt(flight_context2, metar_data1, metar_data2)
+            with timer.stage("risks"):
+                for chunk in model2.generate_content(prompt, stream=True):
+                    text = chunk_text(chunk)
+                    if text:
+                        timer.mark("first_token")
+                        parts.append(text)
+                        yield sse("risks", {"text": text})
+            flight_context = "".join(parts)
+            token_stats.record("analyze-flight/stream/risks", prompt, response_text=flight_context)
+            analysis_cache.put(risk_key, flight_context)
+        elif flight_context:
+            yield sse("risks", {"text": flight_context})
+        flight_context = flight_context or flight_context2
+
+        with timer.stage("retrieval"):
+            relevant_regs = get_relevant_regulations(flight_context, 5)
+        yield sse("regulations", {"regulations": [{"id": r["id"], "title": r["title"]} for r in relevant_regs]})
+
+        analysis_key = canonical_key("analysis", ANALYSIS_PROMPT_VERSION, flight_key, [r["id"] for r in relevant_regs])
+        ai_analysis = analysis_cache.get(analysis_key)
+        sections = None
+        if ai_analysis is None and model:
+            sections = JsonSectionParser(ANALYSIS_SECTIONS)
+            prompt = analysis_prompt(flight_context2, relevant_regs)
+            try:
+                with timer.stage("analysis"):
+                    response = model.generate_content(prompt,
+                                                      generation_config=genai.GenerationConfig(response_mime_type="application/json",
+                                                                                               response_schema = responseSchema),
+                                                      stream=True)
+                    for chunk in response:
+                        for key, value in sections.feed(chunk_text(chunk)):
+                            yield sse(key, value)
+                token_stats.record("analyze-flight/stream/analysis", prompt, response_text=sections.buffer)
+                ai_analysis = json.loads(sections.buffer)
+                analysis_cache.put(analysis_key, ai_analysis)
+            except Exception as e:
+                print(f"Error with Gemini API: {e}")
+                # Sections already sent are superseded by the fallback below
+                ai_analysis = None
+                sections = None
+        if ai_analysis is None:
+            ai_analysis = fallback_analysis(relevant_regs)
+        # Anything not streamed (cache hit, fallback) is sent whole
+        emitted = sections.emitted if sections else set()
+        for key in ANALYSIS_SECTIONS:
+            if key not in emitted:
+                yield sse(key, ai_analysis.get(key, []))
+
+        store_in_background('flight_analyses', {
+            "departure": departure,
+            "arrival": arrival,
+            "aircraft": aircraft,
+            "date": date,
+            "passengers": passengers,
+            "analysis": ai_analysis,
+            "timestamp": firestore.SERVER_TIMESTAMP if db else datetime.now().isoformat()
+        })
+        timings = timer.as_dict()
+        print(f"analyze-flight stream timings: {timings}")
+        yield sse("done", {"analysis": ai_analysis, "timings": timings})
+
+    return event_stream(events())
+
+# Concurrent Gemini calls in a schedule run; gemini_bucket still caps the request rate
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 4))
+BATCH_OUTPUT_DIR = os.environ.get("BATCH_OUTPUT_DIR", os.path.join(os.path.dirname(__file__), "batch_output"))
+
+def cached_risk_summary(group):
+    """Risk summary for one distinct flight, shared with /api/analyze-flight through analysis_cache."""
+    summary = analysis_cache.get(group["risk_key"])
+    if summary is None:
+        gemini_bucket.acquire()
+        prompt = risk_prompt(group["details"], *group["weather_text"])
+        response = model2.generate_content(prompt)
+        token_stats.record("analyze-schedule/risks", prompt, response)
+        summary = response.text
+        analysis_cache.put(group["risk_key"], summary)
+    return summary
+
+def cached_flight_analysis(analysis_key, details, relevant_regs):
+    ai_analysis = analysis_cache.get(analysis_key)
+    if ai_analysis is None:
+        gemini_bucket.acquire()
+        prompt = analysis_prompt(details, relevant_regs)
+        response = model.generate_content(prompt, generation_config=genai.GenerationConfig(
+            response_mime_type="application/json", response_schema=responseSchema))
+        token_stats.record("analyze-schedule/analysis", prompt, response)
+        ai_analysis = json.loads(response.text)
+        analysis_cache.put(analysis_key, ai_analysis)
+    return ai_analysis
+
+def group_schedule(legs, metars):
+    """
+    Groups legs that need identical work: same flight (route, aircraft, date, passengers)
+    in the same bucketed weather. Features and prompts are built once per group.
+    """
+    groups = {}
+    for leg in legs:
+        departure_metar, arrival_metar = metars.get(leg["departure"]), metars.get(leg["arrival"])
+        flight_key = [leg["departure"], leg["arrival"], leg["aircraft"].lower(), leg["date"], leg["passengers"]]
+        risk_key = canonical_key("risks", RISK_PROMPT_VERSION, flight_key,
+                                 bucket_metar(departure_metar), bucket_metar(arrival_metar))
+        if risk_key not in groups:
+            groups[risk_key] = {
+                "risk_key": risk_key,
+                "flight_key": flight_key,
+                "aircraft": leg["aircraft"],
+                "details": flight_details_text(*(leg[field] for field in LEG_FIELDS)),
+                "weather_text": (
+                    f"information at {leg['departure']}: ```" + get_from_metar(departure_metar or {}) + "```",
+                    f"information at {leg['arrival']}: ```" + get_from_metar(arrival_metar or {}) + "```"
+                ),
+                "legs": []
+            }
+        groups[risk_key]["legs"].append(leg)
+    return list(groups.values())
+
+def analyze_schedule(legs, output_path, progress=None):
+    """
+    Compliance analysis for a whole schedule with the work shared across legs: each station's
+    METAR is fetched once, legs needing identical work are grouped, retrieval for every group
+    is one batched search, and Gemini is called once per distinct input. One JSON line per leg
+    is appended to `output_path` as its analysis finishes; legs already in the file are skipped.
+    Returns the run's BatchProgress.
+    """
+    done = read_checkpoint(output_path)
+    pending = [leg for leg in legs if leg_key(leg) not in done]
+    progress = progress or BatchProgress(len(legs))
+    progress.skipped = len(legs) - len(pending)
+    timer = StageTimer()
+    writer = ResultWriter(output_path)
+    try:
+        with timer.stage("weather"):
+            metars = get_metars([station for leg in pending for station in (leg["departure"], leg["arrival"])])
+        groups = group_schedule(pending, metars)
+        progress.shared.update(legs=len(pending), stations=len(metars), distinct_flights=len(groups))
+
+        with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm") as pool:
+            with timer.stage("risks"):
+                if model:
+                    futures = {pool.submit(cached_risk_summary, group): group for group in groups}
+                    for future in as_completed(futures):
+                        try:
+                            futures[future]["risks"] = future.result()
+                        except Exception as e:
+                            print(f"Error summarizing risks for {futures[future]['flight_key']}: {e}")
+
+            with timer.stage("retrieval"):
+                if encoder and index:
+                    queries = []
+                    for group in groups:
+                        queries.append(f"{group['details']}\n" + "\n".join(group["weather_text"]))
+                        queries.append(group.get("risks") or queries[-1])
+                    found = get_relevant_regulations_batch(queries, 5)
+                    for n, group in enumerate(groups):
+                        group["regulations"] = merge_sections([found[2 * n + 1], found[2 * n]], 5)
+                    progress.shared["retrieval_queries"] = len(queries)
+                else:
+                    for group in groups:
+                        group["regulations"] = fallback_regulations(group["aircraft"])
+
+            # Groups whose flight and retrieved regulations match share one analysis call
+            analyses = {}
+            for group in groups:
+                key = canonical_key("analysis", ANALYSIS_PROMPT_VERSION, group["flight_key"],
+                                    [r["id"] for r in group["regulations"]])
+                analyses.setdefault(key, []).append(group)
+            progress.shared["analysis_calls"] = len(analyses)
+
+            with timer.stage("analysis"):
+                if model:
+                    futures = {pool.submit(cached_flight_analysis, key, members[0]["details"], members[0]["regulations"]): members
+                               for key, members in analyses.items()}
+                    for future in as_completed(futures):
+                        try:
+                            ai_analysis = future.result()
+                        except Exception as e:
+                            print(f"Error analyzing schedule legs: {e}")
+                            for group in futures[future]:
+                                for _ in group["legs"]:
+                                    progress.leg_done(ok=False)
+                            continue
+                        write_schedule_results(writer, futures[future], ai_analysis, progress)
+                else:
+                    for members in analyses.values():
+                        write_schedule_results(writer, members, mock_analysis(members[0]["aircraft"], members[0]["regulations"]), progress)
+    finally:
+        writer.close()
+        progress.stages = timer.as_dict()
+        progress.finish()
+    return progress
+
+def write_schedule_results(writer, groups, ai_analysis, progress):
+    for group in groups:
+        for leg in group["legs"]:
+            writer.write({
+                "leg_key": leg_key(leg),
+                "flight_details": {field: leg[field] for field in LEG_FIELDS},
+                "regulations": [r["id"] for r in group["regulations"]],
+                "analysis": ai_analysis
+            })
+            progress.leg_done()
+
+schedule_jobs = {}
+schedule_jobs_lock = threading.Lock()
+
+def run_schedule_job(legs, output_path, progress):
+    try:
+        analyze_schedule(legs, output_path, progress)
+    except Exception as e:
+        print(f"Schedule job failed: {e}")
+        progress.error = str(e)
+        progress.finish()
+    print(f"Schedule job {output_path}: {progress.as_dict()}")
+
+@app.route('/api/analyze-schedule', methods=['POST'])
+def analyze_schedule_job():
+    """
+    Starts a batch analysis of a schedule, given as JSON {"legs": [...]} or an uploaded CSV/JSONL
+    `schedule` file, and returns 202 with the job id. The id is derived from the legs, so
+    posting the same schedule again resumes the job rather than starting over.
+    """
+    try:
+        if 'schedule' in request.files:
+            legs = parse_schedule(request.files['schedule'].read().decode('utf-8'))
+        else:
+            legs = [normalize_leg(leg) for leg in (request.get_json(silent=True) or {}).get('legs', [])]
+    except ValueError as e:
+        return jsonify({"error": f"Could not parse schedule: {e}"}), 400
+    if not legs:
+        return jsonify({"error": "No legs provided"}), 400
+
+    job_id = canonical_key([leg_key(leg) for leg in legs])[:16]
+    output_path = os.path.join(BATCH_OUTPUT_DIR, f"{job_id}.jsonl")
+    with schedule_jobs_lock:
+        progress = schedule_jobs.get(job_id)
+        if progress is None or progress.finished is not None:
+            progress = schedule_jobs[job_id] = BatchProgress(len(legs))
+            threading.Thread(target=run_schedule_job, args=(legs, output_path, progress),
+                             name=f"schedule-{job_id}", daemon=True).start()
+    return jsonify({"job_id": job_id, "status_url": f"/api/analyze-schedule/{job_id}"}), 202
+
+@app.route('/api/analyze-schedule/<job_id>', methods=['GET'])
+def analyze_schedule_status(job_id):
+    """Progress and throughput of a schedule job; ?results=true also returns the legs finished so far."""
+    output_path = os.path.join(BATCH_OUTPUT_DIR, f"{os.path.basename(job_id)}.jsonl")
+    progress = schedule_jobs.get(job_id)
+    if progress is None and not os.path.exists(output_path):
+        return jsonify({"error": "Unknown job"}), 404
+    body = {"job_id": job_id, "progress": progress.as_dict() if progress else None}
+    if request.args.get('results', '').lower() in ("1", "true", "yes") and os.path.exists(output_path):
+        with open(output_path, encoding='utf-8') as f:
+            body["results"] = [json.loads(line) for line in f if line.strip()]
+    return jsonify(body)
+
+@app.route('/api/regulations/search', methods=['POST'])
+async def search_regulations():
+    """
+    Multi-query retrieval: {"queries": [...], "k": 5 or [k per query], "budget": 10} returns one
+    fused, de-duplicated list of sections. All queries share one encoder pass and one index search.
+    """
+    data = request.get_json(silent=True) or {}
+    queries = [q for q in data.get('queries', []) if isinstance(q, str) and q.strip()]
+    if not queries:
+        return jsonify({"error": "No queries provided"}), 400
+    timer = StageTimer()
+    try:
+        with timer.stage("retrieval"):
+            sections = await run_blocking(get_relevant_regulations_multi, queries,
+                                          data.get('k', MULTI_QUERY_K), int(data.get('budget', MULTI_QUERY_BUDGET)),
+                                          pool=cpu_pool)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify({"regulations": sections, "queries": queries})
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+# Largest page /api/regulations returns when a `limit` is given
+REGULATIONS_MAX_PAGE_SIZE = 500
 
 @app.route('/api/regulations', methods=['GET'])
 def get_regulations():
     # Get query parameters
     category = request.args.get('category', None)
-    search = request.args.get('search', None)
+    search = (request.args.get('search') or '').strip()
     aircraft_type = request.args.get('aircraft_type', None)
-    
-    if db:
-        # Query Firestore
-        query = db.collection('regulations')
-        
-        if category:
-            query = query.where('category', '==', category)
-        
-        results = query.get()
-        regulations_list = [doc.to_dict() for doc in results]
-    else:
-        # Without Firebase, use our local data
-        regulations_list = regulations
-        if category:
-            regulations_list = [r for r in regulations_list if r['category'] == category]
-    
-    # Filter by aircraft type (prioritize Gulfstream 550)
-    if aircraft_type:
-        # First include exact matches
-        exact_matches = [r for r in regulations_list if 'aircraft_types' in r and aircraft_type in r['aircraft_types']]
-        # Then include regulations with no specific aircraft type (general regulations)
-        general_regs = [r for r in regulations_list if 'aircraft_types' not in r]
-        regulations_list = exact_matches + general_regs
-    elif 'GLF5' not in request.args.get('exclude_prioritization', ''):
-        # If no specific filter but we're not explicitly asked to exclude prioritization,
-        # still prioritize G550 regulations
-        g550_regs = [r for r in regulations_list if 'aircraft_types' in r and 'GLF5' in r['aircraft_types']]
-        other_regs = [r for r in regulations_list if 'aircraft_types' not in r or 'GLF5' not in r['aircraft_types']]
-        regulations_list = g550_regs + other_regs
-    
-    # If search term provided, filter results
-    if search and search.strip():
-        search_lower = search.lower()
-        regulations_list = [
-            r for r in regulations_list 
-            if search_lower in r['title'].lower() or search_lower in r['content'].lower()
-        ]
-    
-    return jsonify(regulations_list)
+    cursor = request.args.get('cursor')
+    try:
+        limit = max(min(int(request.args['limit']), REGULATIONS_MAX_PAGE_SIZE), 1) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    # Without an aircraft filter, G550 regulations come first unless explicitly excluded
+    prioritize = None if 'GLF5' in request.args.get('exclude_prioritization', '') else 'GLF5'
+
+    # The ETag covers the corpus content and the query, so a client holding the same page gets a 304
+    # Searches also depend on the keyword index, which catches up with changes in the background
+    keyword_version = regulation_index.keyword_version if search else None
+    etag = canonical_key(regulation_index.digest, keyword_version, category, aircraft_type, prioritize,
+                         search, cursor, limit)[:32]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    # If search term provided, rank the results with BM25 over the same regulations the index serves
+    rank = regulation_index.search(search) if search else None
+
+    # Filters are set intersections over the precomputed indexes
+    ids = regulation_index.query(category, aircraft_type, prioritize, rank)
+    try:
+        page, next_cursor = regulation_index.page(ids, cursor, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = jsonify(page)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# Window of amendment dates /api/fetch-faa-updates covers when no `since` is given
+UPDATES_WINDOW_DAYS = 120
+
+def feed_args(default_days=None):
+    """
+    Reads since/cursor/limit query parameters. Malformed values raise ValueError with a fixed
+    message that is safe to return to the client.
+    """
+    since = request.args.get('since')
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError:
+            raise ValueError("since must be a date or an ISO 8601 timestamp") from None
+    elif default_days:
+        since = datetime.now(timezone.utc) - timedelta(days=default_days)
+    try:
+        limit = min(int(request.args.get('limit', FEED_PAGE_SIZE)), FEED_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            decode_feed_cursor(cursor)
+        except ValueError:
+            raise ValueError("Invalid cursor") from None
+    return since, cursor, max(limit, 1)
+
+def regulation_feed_page(since=None, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    One page of regulations dated at or after `since`, newest first, and the cursor of the
+    next page. Uses an indexed range query in Firestore, or the local sorted index without it.
+    """
+    if store:
+        return firestore_page(store, since, cursor, limit)
+    return change_feed.page(since, cursor, limit)
+
+@app.route('/api/regulation-changes', methods=['GET'])
+def get_regulation_changes():
+    """Change feed: ?since=2025-01-01 returns only regulations amended since then, paged with ?cursor=."""
+    try:
+        since, cursor, limit = feed_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    page, next_cursor = regulation_feed_page(since, cursor, limit)
+    return jsonify({"regulations": page, "next_cursor": next_cursor, "since": since.isoformat() if since else None})
 
 @app.route('/api/fetch-faa-updates', methods=['GET'])
-def fetch_faa_updates():
-        """Fetch latest FAA updates from RSS feeds and APIs"""
-    # try:
-        # Mock data with emphasis on Gulfstream 550
-        updates = []
-        today = datetime.today()
-        thirty_days_ago = today - timedelta(days=120)
-
-        # Reference to the regulations collection
-        regulations_ref = db.collection('regulations')
-
-        # Query the collection for regulations with a date within the last 30 days
-        query = regulations_ref.stream()
-
-        # List to hold the regulations that match the filter
-        recent_regulations = []
-
-        for regulation in query:
-            regulation_data = regulation.to_dict()
-            print(regulation_data['date'])
-            # Handle regulations with an unknown date
-            if (regulation_data['date']== None) or regulation_data['date'].lower() == "unknown":
-                regulation_data['date'] = "1900-01-01"  # Treat "Unknown" dates as the earliest possible date
-            try:
-                # Parse the date
-                regulation_date = datetime.strptime(regulation_data['date'], '%Y-%m-%d')
-                
-                # Only add regulations within the last 30 days or with an unknown date
-                if regulation_date >= thirty_days_ago:
-                    regulation_data['id'] = regulation.id
-                    recent_regulations.append(regulation_data)
-            except ValueError as e:
-                print(e)
-                # Skip regulations with invalid date values (not "unknown")
-                pass
-
-    # Sort regulations by date (most recent first), with "unknown" at the end
-        recent_regulations.sort(key=lambda x: (x['date'], x['date'] != "1900-01-01"), reverse=True)
-
-        updates = recent_regulations
-       
-    # Return the number of new regulations and the sorted list
- 
-        # Store updates in Firebase
-        def is_update_processed(update_id, db):
-            try:
-                doc_ref = db.collection('faa_updates').document(update_id)
-            except:
-                return False
-            doc = doc_ref.get()
-            
-            if doc.exists:
-                return doc.to_dict().get('processed', False)
-            return False 
-        if db:
-            for update in updates:
-                # Check if the update already exists in the database and if it was processed
-                if not is_update_processed(update['id'], db):
-                    # If not processed, add timestamp and mark it as unprocessed
-                    update['timestamp'] = firestore.SERVER_TIMESTAMP
-                    update['processed'] = False
-                    db.collection('faa_updates').document(update["id"]).set(update)
-
-# Process updates with Gemini AI
+async def fetch_faa_updates():
+    """
+    Returns recent FAA updates at once, with the AI analyses finished so far. Unprocessed
+    updates are queued for background analysis; `progress` reports how far along that is.
+    Accepts the change feed's since/cursor/limit parameters.
+    """
+    try:
+        since, cursor, limit = feed_args(UPDATES_WINDOW_DAYS)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(await run_blocking(collect_faa_updates, since, cursor, limit))
+
+def update_job_key(update):
+    # Edited text gets a new key, so a changed update is analysed again
+    return "faa_update:" + canonical_key(update['id'], update['title'], update['content'], update['date'])
+
+def collect_faa_updates(since=None, cursor=None, limit=FEED_PAGE_SIZE):
+    """Fetch a page of recent FAA updates and queue any that still need AI analysis"""
+    updates, next_cursor = regulation_feed_page(since, cursor, limit)
+
+    # One batched read for the stored state of every update instead of a read per update
+    stored = store.get_many('faa_updates', [u['id'] for u in updates]) if store and updates else {}
+
+    new_records = []
+    keys = []
+    for update in updates:
+        record = stored.get(update['id'])
+        if record and record.get('processed'):
+            update['processed'] = True
+            update['ai_analysis'] = record.get('ai_analysis')
+            continue
+        key = update_job_key(update)
+        keys.append(key)
+        result = faa_update_jobs.result(key)
+        if result:
+            # Finished in the background since the Firestore read above
+            update['processed'] = True
+            update['ai_analysis'] = result
+            continue
+        update['processed'] = False
+        if record is None:
+            new_records.append(("set", 'faa_updates', update['id'], dict(update, timestamp=firestore.SERVER_TIMESTAMP)))
         if model:
-            for update in updates:
-                # Check if the update has already been processed in Firestore
-                if not is_update_processed(update['id'], db):
-                    # If not processed, run the AI processing
-                    try:
-                        process_update_with_ai(update)
-                        
-                        # After processing, mark the update as processed
-                        update['processed'] = True
-                    except Exception as e:
-                        print(e)
-                        pass
-                    # Update the processed status in Firestore
-                else:
-                    update['ai_analysis'] = db.collection('faa_updates').document(update["id"]).get().to_dict().get('ai_analysis')
-                    
-                
-        # Prioritize Gulfstream 550 updates
-        g550_updates = [u for u in updates if 'aircraft_types' in u and 'GLF5' in u['aircraft_types']]
-        other_updates = [u for u in updates if 'aircraft_types' not in u or 'GLF5' not in u['aircraft_types']]
-        prioritized_updates = g550_updates + other_updates
-        
-        return jsonify({"status": "success", "updates": prioritized_updates})
-    
-    # except Exception as e:
-    #     print(e)
-    #     return jsonify({"status": "error", "message": str(e)})
+            faa_update_jobs.submit(key, update)
+    if store and new_records:
+        store.write(new_records)
+
+    progress = faa_update_jobs.progress(keys)
+    progress["processed"] = sum(1 for u in updates if u['processed'])
+    progress["total"] = len(updates)
+
+    # Prioritize Gulfstream 550 updates
+    g550_updates = [u for u in updates if 'aircraft_types' in u and 'GLF5' in u['aircraft_types']]
+    other_updates = [u for u in updates if 'aircraft_types' not in u or 'GLF5' not in u['aircraft_types']]
+    prioritized_updates = g550_updates + other_updates
+
+    return {"status": "success", "updates": prioritized_updates, "next_cursor": next_cursor,
+            "progress": progress, "changes": change_counts(regulation_changes, since)}
+
+def change_counts(changes, since=None):
+    """
+    Size of the last ingest's change log, without its id lists (which grow with the corpus).
+    The changed regulations themselves are paged from the change feed at `feed`.
+    """
+    counts = {field: len(changes.get(field, [])) for field in ("added", "modified", "removed")}
+    counts.update(unchanged=changes.get("unchanged", 0), ecfr_date=changes.get("ecfr_date"),
+                  timestamp=changes.get("timestamp"))
+    counts["feed"] = "/api/regulation-changes" + (f"?since={since.date().isoformat()}" if since else "")
+    return counts
 
  
 class processUpdateChild(typing.TypedDict):
@@ -487,11 +1172,10 @@ class processUpdateChild(typing.TypedDict):
 
 
 def process_update_with_ai(update):
-    """Process FAA updates with Gemini AI to extract key information"""
-    if not model:
-        # Skip if no AI model is available
-        return
-        
+    """
+    Process an FAA update with Gemini AI to extract key information. Runs as a background
+    job, so errors propagate to the job queue for retry.
+    """
     prompt = f"""
     Analyze this FAA update:
     
@@ -504,28 +1188,23 @@ def process_update_with_ai(update):
     
     """
     
-    try:
-        response = model2.generate_content(prompt)
-        print(response.text)
-        ai_analysis = {"applicability": response.text}
-       
-        # Update the record in Firebase
-        if db:
-            update_query = db.collection('faa_updates').where('title', '==', update['title']).limit(1)
-            docs = update_query.get()
-            
-            for doc in docs:
-                doc.reference.update({
-                    "ai_analysis": ai_analysis,
-                    "processed": True
-                })
-                update["ai_analysis"] = ai_analysis
-    
-    except Exception as e:
-        print(f"Error processing update with AI: {e}")
+    response = model2.generate_content(prompt)
+    token_stats.record("fetch-faa-updates", prompt, response)
+    ai_analysis = {"applicability": response.text}
+
+    # Update the record in Firebase
+    if db:
+        store.set('faa_updates', update['id'], {
+            "ai_analysis": ai_analysis,
+            "processed": True
+        }, merge=True)
+    return ai_analysis
+
+# Background analysis of FAA updates, rate limited to the Gemini quota
+faa_update_jobs = JobQueue(process_update_with_ai, bucket=gemini_bucket, name="faa-updates")
 
 @app.route('/api/generate-action-items', methods=['POST'])
-def generate_action_items():
+async def generate_action_items():
     """Generate action items based on flight analysis"""
     data = request.json
     flight_id = data.get('flight_id')
@@ -537,14 +1216,7 @@ def generate_action_items():
     flight_data = None
     
     if db:
-        flight_docs = db.collection('flight_analyses').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(1).stream()
-        print(flight_docs)
-        # Get the first document
-        flight_doc = next(flight_docs, None)
-        if flight_doc.exists:
-            flight_data = flight_doc.to_dict()
-            print(flight_data)
-        del flight_data["analysis"]["required_actions"] 
+        flight_data = await run_blocking(latest_flight_analysis)
 
 
     if not flight_data:
@@ -594,8 +1266,11 @@ def generate_action_items():
         """
         
         try:
-            response = model.generate_content(prompt, generation_config=genai.GenerationConfig(response_mime_type="application/json",
-                                                response_schema = list[actionItems]))
+            response = await run_blocking(functools.partial(
+                model.generate_content, prompt,
+                generation_config=genai.GenerationConfig(response_mime_type="application/json",
+                                                         response_schema=list[actionItems])))
+            token_stats.record("generate-action-items", prompt, response)
             print(response)
             action_items = json.loads(response.text)
 
@@ -604,9 +1279,7 @@ def generate_action_items():
     
     # If AI failed or no model, use mock data
     if not action_items:
-        is_g550 = "gulfstream" in flight_data["aircraft"].lower() and "550" in flight_data["aircraft"]
-        
-        if is_g550:
+        if is_g550(flight_data["aircraft"]):
             action_items = [
                 {
                     "title": "Verify RVSM certification",
@@ -651,44 +1324,154 @@ def generate_action_items():
     
     # Store action items in Firebase
     if db:
-        for item in action_items:
-            try:
-                item_data = {
-                    "flight_id": flight_id,
-                    "title": item["title"],
-                    "description": item["description"],
-                    "due_date": item["due_date"],
-                    "responsible_role": item["responsible_role"],
-                    "status": "pending",
-                    "created_at": firestore.SERVER_TIMESTAMP
-                }
-                
-                db.collection('action_items').add(item_data)
-            except Exception as e:
-                print (item,e)
-                action_items.remove(item)
+        await run_blocking(store_action_items, flight_id, action_items)
     
     return jsonify({"status": "success", "action_items": action_items})
 
-def get_relevant_regulations(query: str, n_results: int = 5):
-    """Search for relevant regulations using vector similarity."""
+def latest_flight_analysis():
+    """Most recent flight analysis from Firestore, without its required actions."""
+    flights = store.query('flight_analyses', order_by='timestamp', descending=True, limit=1)
+    if not flights:
+        return None
+    flight_data = flights[0]
+    flight_data.pop("id", None)
+    flight_data.get("analysis", {}).pop("required_actions", None)
+    return flight_data
+
+def store_action_items(flight_id, action_items):
+    """Stores action items in Firebase in one batched write, dropping any that are malformed."""
+    records = []
+    kept = []
+    for item in action_items:
+        try:
+            records.append({
+                "flight_id": flight_id,
+                "title": item["title"],
+                "description": item["description"],
+                "due_date": item["due_date"],
+                "responsible_role": item["responsible_role"],
+                "status": "pending",
+                "created_at": firestore.SERVER_TIMESTAMP
+            })
+            kept.append(item)
+        except Exception as e:
+            print (item,e)
+    action_items[:] = kept
+    try:
+        store.add_many('action_items', records)
+    except Exception as e:
+        print(f"Error storing action items: {e}")
+
+# Passages fetched per requested section, so several hits in one section still yield n sections
+PASSAGE_OVERFETCH = 4
+
+def get_relevant_regulations(query: str, n_results: int = 5, rerank=None):
+    """
+    Hybrid search for relevant regulations: dense vector similarity and BM25 over passages,
+    fused with reciprocal rank fusion. Returns de-duplicated parent sections, each with the
+    passages that matched. With the re-ranker enabled (or `rerank=True`), a wider candidate
+    set is re-ordered by the cross-encoder and trimmed to its threshold and token budget.
+    """
+    rerank = reranker is not None and (rerank if rerank is not None else True)
+    k = RERANK_CANDIDATES if rerank else n_results * PASSAGE_OVERFETCH
+    rankings = []
      # Query FAISS for relevant regulations if available
     if encoder and index:
-        query_embedding = encoder.encode([query])
-        distances, indices = index.search(np.array(query_embedding).astype('float32'), n_results)
-        relevant_regs = [regulations[idx] for idx in indices[0]]
-    
-        return relevant_regs
-    else:
-        return []
+        query_embedding = query_cache.embedding(query, lambda q: embedder.encode([q])[0])
+        rows = query_cache.search(query_embedding, k, index_version,
+                                  lambda: index.search(query_embedding[None, :], k)[1][0])
+        rankings.append(rows)
+    # Keyword hits catch exact section numbers and terms like "135.89" or "TCAS"
+    if passage_keyword_index:
+        rankings.append([row for row, _ in passage_keyword_index.search(query, k)])
+
+    rows = reciprocal_rank_fusion(rankings)
+    if rerank:
+        try:
+            rows, stats = reranker.rerank(query, rows[:RERANK_CANDIDATES], lambda row: passages[row]['content'])
+            print(f"rerank: {stats}")
+        except Exception as e:
+            print(f"Re-ranking failed, using first-stage order: {e}")
+    return group_by_parent(passages, regulations_by_id, rows, n_results)
+
+def search_passages_batch(queries, k):
+    """
+    Dense and BM25 passage rankings for each query. Uncached query embeddings go to the
+    embedding batcher together, so they share forward passes with each other and with concurrent
+    requests, and all queries are searched with a single index.search on an (N, 384) matrix.
+    """
+    rankings = [[] for _ in queries]
+    if encoder and index and queries:
+        vectors = query_cache.embedding_many(queries, embedder.encode)
+        _, rows = index.search(vectors, k)
+        for ranking, query_rows in zip(rankings, rows):
+            ranking.append([int(row) for row in query_rows])
+    if passage_keyword_index:
+        for ranking, query in zip(rankings, queries):
+            ranking.append([row for row, _ in passage_keyword_index.search(query, k)])
+    return rankings
+
+def get_relevant_regulations_batch(queries, n_results: int = 5):
+    """get_relevant_regulations for many independent queries at once; returns one section list per query."""
+    rankings = search_passages_batch(queries, n_results * PASSAGE_OVERFETCH)
+    return [group_by_parent(passages, regulations_by_id, reciprocal_rank_fusion(ranking), n_results)
+            for ranking in rankings]
+
+# Default sections per sub-query and in total for multi-query retrieval
+MULTI_QUERY_K = 5
+MULTI_QUERY_BUDGET = 10
+# Larger per-query k values are clamped, so one request can't ask FAISS for the whole corpus
+MULTI_QUERY_MAX_K = 50
+
+def get_relevant_regulations_multi(queries, k=MULTI_QUERY_K, budget=MULTI_QUERY_BUDGET, rrf_k=60):
+    """
+    Retrieval with several sub-queries (e.g. departure risks, arrival weather, aircraft type)
+    fused into one list. Each query contributes its top `k` sections' worth of passages (`k`
+    may be a list, one per query); the dense and keyword rankings of every query are fused
+    with reciprocal rank fusion, and at most `budget` de-duplicated sections are returned.
+    Each section carries its fused `score` and the indexes of the `matched_queries`.
+    """
+    ks = [int(n) for n in k] if isinstance(k, (list, tuple)) else [int(k)] * len(queries)
+    if len(ks) != len(queries):
+        raise ValueError("k must be a number or have one entry per query")
+    if min(ks, default=1) < 1 or budget < 1:
+        raise ValueError("k and budget must be positive")
+    ks = [min(n, MULTI_QUERY_MAX_K) for n in ks]
+    rankings = search_passages_batch(queries, max(ks, default=0) * PASSAGE_OVERFETCH)
+
+    scores = {}
+    matched = {}
+    for position, query_rankings in enumerate(rankings):
+        depth = ks[position] * PASSAGE_OVERFETCH
+        for ranking in query_rankings:
+            for rank, row in enumerate(ranking[:depth]):
+                if row < 0:
+                    continue
+                scores[row] = scores.get(row, 0.0) + 1.0 / (rrf_k + rank + 1)
+                matched.setdefault(row, set()).add(position)
+    rows = sorted(scores, key=lambda row: scores[row], reverse=True)
+
+    sections = group_by_parent(passages, regulations_by_id, rows, budget)
+    by_id = {section['id']: section for section in sections}
+    for row in rows:
+        section = by_id.get(passages[row]['parent'])
+        if section is None:
+            continue
+        section['score'] = max(section.get('score', 0.0), scores[row])
+        section['matched_queries'] = sorted(set(section.get('matched_queries', [])) | matched[row])
+    return sections
+
+def pack_regulations(regulations, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    The regulations' matched passages as compact "[id] title: text" lines within `budget`
+    tokens, best passages first. Returns (text, ids of the regulations that made it in).
+    """
+    text, ids, _ = pack_sections(regulations, budget)
+    return text, ids
 
 def format_regulations_for_context(regulations) -> str:
     """Format regulations into a string for the prompt."""
-    context = "Relevant FAA Part 135 regulations:\n\n"
-    for reg in regulations:
-        context += f"Section {reg['id']}, {reg['title']}:\n"
-        context += f"{reg['content']}\n\n"
-    return context
+    return "Relevant FAA regulations:\n" + pack_regulations(regulations)[0] + "\n"
 
 CHAT_SYSTEM_PROMPT = """You are an expert FAA regulations assistant specializing in Part 135 operations. 
 Your role is to help users understand and comply with FAA regulations.
@@ -711,8 +1494,59 @@ Remember to:
 - Suggest compliance strategies
 """
 
+# Sessions live in memory; set CHAT_SESSIONS_PERSIST=1 to also keep them in Firestore
+chat_sessions = ChatSessionStore(
+    backend=FirestoreSessionBackend(store) if store and os.environ.get("CHAT_SESSIONS_PERSIST") else None
+)
+
+def chat_turn_message(session, user_message, relevant_regulations):
+    """
+    Builds this turn's message. The system prompt goes out with the first turn only, and
+    only regulations not already in the conversation are added. Returns (message, new ids).
+    """
+    known = session.context_ids
+    new_regs = [reg for reg in relevant_regulations if reg['id'] not in known]
+    context, new_ids = pack_regulations(new_regs)
+    context = f"Relevant FAA regulations:\n{context}\n"
+    if not session.turns and not session.summary:
+        prompt = CHAT_SYSTEM_PROMPT.format(context=context)
+        message = f"System: {prompt}\n\nUser: {user_message}"
+    elif new_ids:
+        message = f"{context}User: {user_message}"
+    else:
+        message = f"User: {user_message}"
+    return message, new_ids
+
+def chat_history(session):
+    preamble = "System: " + CHAT_SYSTEM_PROMPT.format(context="Regulation sections added to the conversation as needed")
+    return session.history(preamble)
+
+def history_text(history):
+    return "\n".join(part for turn in history for part in turn["parts"])
+
+def summarize_chat(transcript):
+    prompt = ("Summarize this conversation between a pilot and an FAA regulations assistant in under "
+              "200 words. Keep the questions asked, the regulation sections cited and the conclusions "
+              f"reached.\n\n{transcript}")
+    response = model2.generate_content(prompt)
+    token_stats.record("chat/summary", prompt, response)
+    return response.text
+
+def finish_chat_turn(session, message, reply, regulation_ids):
+    """Records the turn, then summarizes old turns over budget and persists off the response path."""
+    with session.lock:
+        session.add_turn(message, reply, regulation_ids)
+
+    def compact_and_save():
+        try:
+            session.compact(summarize_chat)
+        except Exception as e:
+            print(f"Error summarizing chat session {session.id}: {e}")
+        chat_sessions.save(session)
+    background_pool.submit(compact_and_save)
+
 @app.route("/api/chat", methods=["POST"])
-def chat():
+async def chat():
     try:
         data = request.json
         user_message = data.get("message")
@@ -720,21 +1554,24 @@ def chat():
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
 
+        session = await run_blocking(chat_sessions.get, data.get("session_id"))
+
         # Get relevant regulations using RAG
-        relevant_regulations = get_relevant_regulations(user_message)
-        context = format_regulations_for_context(relevant_regulations)
-        
-        # Prepare the chat prompt
-        prompt = CHAT_SYSTEM_PROMPT.format(context=context)
-        
-        # Generate response using Gemini
-        chat = model2.start_chat(history=[])
-        response = chat.send_message(
-            f"System: {prompt}\n\nUser: {user_message}",
-        )
+        relevant_regulations = await run_blocking(get_relevant_regulations, user_message, pool=cpu_pool)
+
+        with session.lock:
+            message, new_ids = chat_turn_message(session, user_message, relevant_regulations)
+            history = chat_history(session)
+
+        # Generate response using Gemini, continuing the session's conversation
+        chat = model2.start_chat(history=history)
+        response = await run_blocking(chat.send_message, message)
+        token_stats.record("chat", f"{history_text(history)}\n{message}", response)
+        finish_chat_turn(session, message, response.text, new_ids)
 
         return jsonify({
             "response": response.text,
+            "session_id": session.id,
             "regulations_used": [relevant_regulations]
         })
 
@@ -745,6 +1582,49 @@ def chat():
             "details": str(e)
         }), 500
 
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Server-Sent Events version of /api/chat: `regulations` first so citations render at once,
+    then Gemini `token` events as they arrive, then `done` with timings (time to first token).
+    """
+    data = request.json
+    user_message = data.get("message")
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+    session = chat_sessions.get(data.get("session_id"))
+    timer = StageTimer()
+
+    def events():
+        with timer.stage("retrieval"):
+            relevant_regulations = get_relevant_regulations(user_message)
+        timer.mark("first_event")
+        yield sse("regulations", {"session_id": session.id, "regulations_used": [relevant_regulations]})
+
+        with session.lock:
+            message, new_ids = chat_turn_message(session, user_message, relevant_regulations)
+            history = chat_history(session)
+        reply = []
+        try:
+            with timer.stage("generation"):
+                chat = model2.start_chat(history=history)
+                for chunk in chat.send_message(message, stream=True):
+                    text = chunk_text(chunk)
+                    if text:
+                        timer.mark("first_token")
+                        reply.append(text)
+                        yield sse("token", {"text": text})
+            token_stats.record("chat/stream", f"{history_text(history)}\n{message}", response_text="".join(reply))
+            finish_chat_turn(session, message, "".join(reply), new_ids)
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            yield sse("error", {"error": "Failed to process chat message", "details": str(e)})
+        timings = timer.as_dict()
+        print(f"chat stream timings: {timings}")
+        yield sse("done", {"session_id": session.id, "timings": timings})
+
+    return event_stream(events())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
 
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from test import iter_regulations
+
+ECFR_BASE_URL = "https://www.ecfr.gov/api/renderer/v1/content/enhanced"
+
+# Subchapters of 14 CFR chapter I for the parts we operate under
+SUBCHAPTERS = {
+    "61": "D",
+    "91": "F",
+    "121": "G",
+    "125": "G",
+    "135": "G",
+}
+
+
+class IngestError(Exception):
+    """Raised when any eCFR target could not be fetched or parsed completely."""
+
+
+def parse_targets(spec, default_date):
+    """
+    Parses a target list like "14:91:2025-03-12,14:91K,14:135" into (title, part, date) tuples.
+    The date may be omitted, in which case `default_date` is used.
+    """
+    targets = []
+    for item in spec.split(","):
+        fields = [f.strip() for f in item.split(":") if f.strip()]
+        if len(fields) < 2:
+            continue
+        title, part = fields[0], fields[1]
+        date = fields[2] if len(fields) > 2 else default_date
+        targets.append((title, part, date))
+    return targets
+
+
+def targets_key(targets):
+    """Snapshot key for a target list: the newest date plus a short hash of the targets."""
+    digest = hashlib.sha256(repr(sorted(targets)).encode("utf-8")).hexdigest()[:8]
+    return f"{max(date for _, _, date in targets)}-{digest}"
+
+
+def ecfr_url(title, part, date):
+    """Builds the eCFR renderer URL for a part, e.g. ("14", "91K", ...) for part 91 subpart K."""
+    subpart = ""
+    if not part[-1].isdigit():
+        part, subpart = part.rstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"), part.lstrip("0123456789")
+    url = f"{ECFR_BASE_URL}/{date}/title-{title}?chapter=I"
+    if part in SUBCHAPTERS:
+        url += f"&subchapter={SUBCHAPTERS[part]}"
+    url += f"&part={part}"
+    if subpart:
+        url += f"&subpart={subpart}"
+    return url
+
+
+def make_session(pool_size=8):
+    """requests session with a keep-alive connection pool shared by all fetch threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def ingest_target(target, session=None):
+    """
+    Streams one target through SectionParser and assigns stable ids like '14 CFR 135.93'.
+    Sections are parsed as chunks arrive, so the part's HTML is never held in memory whole.
+    Returns (target, regulations, seconds); raises IngestError if the part can't be fetched
+    or has no sections.
+    """
+    started = time.perf_counter()
+    title, part, date = target
+    regulations = []
+    try:
+        for reg in iter_regulations(ecfr_url(*target), session=session):
+            reg["id"] = f"{title} CFR {reg['id']}"
+            reg["cfr_part"] = part
+            reg["ecfr_date"] = date
+            regulations.append(reg)
+    except requests.exceptions.RequestException as e:
+        raise IngestError(f"Failed to fetch {target} from eCFR: {e}") from e
+    if not regulations:
+        raise IngestError(f"No sections found for {target}")
+    return target, regulations, time.perf_counter() - started
+
+
+def ingest_cfr_parts(targets, workers=4, processes=False):
+    """
+    Streams the (title, part, date) targets concurrently, each worker fetching and parsing
+    its part chunk by chunk, and merges them into one corpus, de-duplicated by id in target
+    order. Raises IngestError if any target fails: a partial corpus would read as removals
+    to the diff against the stored one. Workers are threads sharing a pooled session; `processes=True` parses on several
+    cores instead, and is only for the command-line ingest: a process pool started while the
+    app is imported would fork its running threads or, under spawn, re-import the app.
+    """
+    if not targets:
+        return []
+    started = time.perf_counter()
+    workers = min(len(targets), workers)
+
+    parsed = {}
+    errors = []
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=min(workers, os.cpu_count() or 1))
+        # Worker processes open their own connections; a session doesn't cross processes
+        session = None
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        session = make_session(workers)
+    with executor:
+        for future in as_completed([executor.submit(ingest_target, target, session) for target in targets]):
+            try:
+                target, regulations, seconds = future.result()
+            except IngestError as e:
+                errors.append(str(e))
+                continue
+            print(f"Ingested {target}: {len(regulations)} sections in {seconds:.2f}s")
+            parsed[target] = regulations
+    if errors:
+        raise IngestError(f"{len(errors)} of {len(targets)} eCFR targets failed: " + "; ".join(errors))
+
+    # Merge in target order so ids and row order are stable between runs
+    corpus = []
+    seen = set()
+    for target in targets:
+        for reg in parsed.get(target, []):
+            if reg["id"] not in seen:
+                seen.add(reg["id"])
+                corpus.append(reg)
+
+    elapsed = time.perf_counter() - started
+    rate = len(corpus) / elapsed if elapsed > 0 else 0.0
+    print(f"Ingested {len(corpus)} sections from {len(targets)} parts in {elapsed:.2f}s ({rate:.1f} sections/s)")
+    return corpus
+
+
+if __name__ == "__main__":
+    targets = parse_targets(os.environ.get("ECFR_TARGETS", "14:91,14:91K,14:135,14:121"), "2025-03-12")
+    ingest_cfr_parts(targets, processes=True)
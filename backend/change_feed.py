@@ -0,0 +1,103 @@
+import base64
+import bisect
+import json
+from datetime import datetime, timezone
+
+FEED_PAGE_SIZE = 100
+FEED_MAX_PAGE_SIZE = 500
+
+
+def effective_timestamp(date):
+    """UTC timestamp for a parsed 'YYYY-MM-DD' amendment date; None when it is missing or 'Unknown'."""
+    if isinstance(date, datetime):
+        return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_dates(regulations):
+    """Adds `effective_at` to each regulation at ingest; the display `date` string is left as is."""
+    for reg in regulations:
+        reg["effective_at"] = effective_timestamp(reg.get("date"))
+    return regulations
+
+
+def backfill_effective_at(store, regulations):
+    """
+    Derives `effective_at` from `date` for stored regulations written before it existed or
+    by something other than the ingest, so they show up in the change feed. Regulations
+    whose date can't be parsed get None and aren't looked at again. Returns the number written.
+    """
+    missing = [reg for reg in regulations if "effective_at" not in reg]
+    for reg in missing:
+        reg["effective_at"] = effective_timestamp(reg.get("date"))
+    if missing:
+        store.write([("merge", "regulations", reg["id"], {"effective_at": reg["effective_at"]}) for reg in missing])
+    return len(missing)
+
+
+def parse_since(value):
+    """Parses a 'since' parameter: a date ('2025-01-01') or an ISO 8601 timestamp."""
+    since = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(reg):
+    payload = json.dumps([reg["effective_at"].isoformat(), reg["id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns (effective_at, id) for a cursor from `encode_cursor`; raises ValueError if malformed."""
+    try:
+        effective_at, reg_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        effective_at = datetime.fromisoformat(effective_at)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    # Anything else would fail later, comparing against the aware timestamps and string ids
+    if effective_at.tzinfo is None or not isinstance(reg_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return effective_at, reg_id
+
+
+class ChangeFeed:
+    """
+    Local sorted index of dated regulations for running without Firestore. Pages run newest
+    first, ties broken by id, and a cursor resumes strictly after the last item returned.
+    """
+
+    def __init__(self, regulations):
+        dated = sorted((r for r in regulations if r.get("effective_at")),
+                       key=lambda r: (r["effective_at"], r["id"]))
+        self._regulations = dated
+        self._keys = [(r["effective_at"], r["id"]) for r in dated]
+
+    def __len__(self):
+        return len(self._regulations)
+
+    def page(self, since=None, cursor=None, limit=FEED_PAGE_SIZE):
+        """Returns (regulations, next_cursor) for regulations dated at or after `since`."""
+        lo = bisect.bisect_left(self._keys, (since, "")) if since else 0
+        hi = bisect.bisect_left(self._keys, decode_cursor(cursor)) if cursor else len(self._keys)
+        start = max(lo, hi - limit)
+        page = [dict(reg) for reg in reversed(self._regulations[start:hi])]
+        next_cursor = encode_cursor(page[-1]) if page and start > lo else None
+        return page, next_cursor
+
+
+def firestore_page(store, since=None, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    Same page as `ChangeFeed.page`, as a range query on the `regulations` collection.
+    Needs the (effective_at DESC, id DESC) composite index in firestore.indexes.json.
+    """
+    filters = [("effective_at", ">=", since)] if since else [("effective_at", ">", datetime.min.replace(tzinfo=timezone.utc))]
+    start_after = None
+    if cursor:
+        effective_at, reg_id = decode_cursor(cursor)
+        start_after = {"effective_at": effective_at, "id": reg_id}
+    page = store.query('regulations', filters, order_by=["effective_at", "id"], descending=True,
+                       limit=limit + 1, start_after=start_after)
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from token_budget import count_tokens
+
+CHAT_SESSION_LIMIT = int(os.environ.get("CHAT_SESSION_LIMIT", 1000))
+# Prompt tokens of history after which older turns are summarized
+CHAT_TOKEN_BUDGET = int(os.environ.get("CHAT_TOKEN_BUDGET", 6000))
+# Most recent turns kept verbatim when summarizing
+CHAT_KEEP_TURNS = int(os.environ.get("CHAT_KEEP_TURNS", 4))
+
+
+class ChatSession:
+    """
+    One conversation. Each turn keeps the message actually sent (including any regulation
+    context added for that turn), the reply, and the ids of the regulations it introduced.
+    """
+
+    def __init__(self, session_id, turns=None, summary=""):
+        self.id = session_id
+        self.turns = turns or []
+        self.summary = summary
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def context_ids(self):
+        """Regulations whose text is already in the conversation."""
+        return {reg_id for turn in self.turns for reg_id in turn.get("regulation_ids", [])}
+
+    def history(self, preamble):
+        """
+        Gemini chat history: the summary of compacted turns (with `preamble`, the system
+        instructions) followed by the turns kept verbatim.
+        """
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [f"{preamble}\n\nSummary of the conversation so far:\n{self.summary}"]})
+            history.append({"role": "model", "parts": ["Understood."]})
+        for turn in self.turns:
+            history.append({"role": "user", "parts": [turn["user"]]})
+            history.append({"role": "model", "parts": [turn["model"]]})
+        return history
+
+    def add_turn(self, message, reply, regulation_ids):
+        self.turns.append({"user": message, "model": reply, "regulation_ids": list(regulation_ids)})
+        self.updated = time.time()
+
+    def tokens(self):
+        return count_tokens(self.summary) + sum(
+            count_tokens(turn["user"]) + count_tokens(turn["model"]) for turn in self.turns
+        )
+
+    def compact(self, summarize, budget=CHAT_TOKEN_BUDGET, keep_turns=CHAT_KEEP_TURNS):
+        """
+        Once the history exceeds `budget`, folds all but the last `keep_turns` turns into the
+        summary using `summarize(text) -> str`. Regulations introduced by folded turns drop
+        out of context_ids, so they are re-sent if a later question needs them.
+
+        Takes `lock` itself and holds it only to snapshot the old turns and to swap the summary
+        in, not during the (slow) summarize call, so new turns aren't held up. If the session
+        was compacted by someone else meanwhile, the summary is discarded.
+        Returns True if the session was compacted.
+        """
+        with self.lock:
+            if self.tokens() <= budget or len(self.turns) <= keep_turns:
+                return False
+            old_turns = self.turns[:-keep_turns] if keep_turns else list(self.turns)
+            previous_summary = self.summary
+        transcript = "\n".join(f"User: {turn['user']}\nAssistant: {turn['model']}" for turn in old_turns)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+        summary = summarize(transcript)
+        with self.lock:
+            # Turns are only ever appended, so the folded ones are still the first ones unless
+            # another compaction already replaced them
+            if self.summary != previous_summary or self.turns[:len(old_turns)] != old_turns:
+                return False
+            self.summary = summary
+            self.turns = self.turns[len(old_turns):]
+        return True
+
+    def to_dict(self):
+        """Snapshot for persisting; safe to call while turns are being added."""
+        with self.lock:
+            return {"turns": list(self.turns), "summary": self.summary, "updated": self.updated}
+
+
+class FirestoreSessionBackend:
+    """
+    Persists sessions in the `chat_sessions` collection so they survive restarts and workers.
+    Reads and writes go through a FirestoreStore, so they are counted with the app's other round trips.
+    """
+
+    def __init__(self, store, collection='chat_sessions'):
+        self.store = store
+        self.collection = collection
+
+    def load(self, session_id):
+        try:
+            data = self.store.get(self.collection, session_id)
+        except Exception as e:
+            print(f"Error loading chat session {session_id}: {e}")
+            return None
+        if data is None:
+            return None
+        return ChatSession(session_id, data.get("turns", []), data.get("summary", ""))
+
+    def save(self, session):
+        try:
+            self.store.set(self.collection, session.id, session.to_dict())
+        except Exception as e:
+            print(f"Error saving chat session {session.id}: {e}")
+
+
+class ChatSessionStore:
+    """Bounded in-memory LRU of chat sessions with an optional persistent backend behind it."""
+
+    def __init__(self, maxsize=CHAT_SESSION_LIMIT, backend=None):
+        self.maxsize = maxsize
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id=None):
+        """Returns the session for `session_id`, loading or creating it as needed."""
+        session_id = session_id or uuid.uuid4().hex
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session:
+                self._sessions.move_to_end(session_id)
+                return session
+        session = (self.backend.load(session_id) if self.backend else None) or ChatSession(session_id)
+        with self._lock:
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return session
+
+    def save(self, session):
+        if self.backend:
+            self.backend.save(session)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "maxsize": self.maxsize, "persistent": self.backend is not None}
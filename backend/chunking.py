@@ -0,0 +1,114 @@
+import re
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces; ~180 words leaves room for the id/title prefix
+MAX_PASSAGE_WORDS = 180
+
+
+def _split_long(paragraph, max_words):
+    # Split an oversized paragraph on sentence boundaries, then hard-wrap if a sentence is still too long
+    pieces = []
+    current = []
+    for sentence in re.split(r"(?<=[.;:])\s+", paragraph):
+        words = sentence.split()
+        while len(words) > max_words:
+            if current:
+                pieces.append(" ".join(current))
+                current = []
+            pieces.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if current and len(current) + len(words) > max_words:
+            pieces.append(" ".join(current))
+            current = []
+        current.extend(words)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_regulation(reg, max_words=MAX_PASSAGE_WORDS):
+    """
+    Splits a regulation section into paragraph-level passages. Short consecutive paragraphs
+    are merged up to `max_words`. Each passage points back to its section through `parent`.
+    """
+    paragraphs = []
+    for paragraph in (reg.get("content") or "").split("\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph.split()) > max_words:
+            paragraphs.extend(_split_long(paragraph, max_words))
+        else:
+            paragraphs.append(paragraph)
+
+    passages = []
+    current = []
+    current_words = 0
+    for paragraph in paragraphs:
+        words = len(paragraph.split())
+        if current and current_words + words > max_words:
+            passages.append("\n".join(current))
+            current = []
+            current_words = 0
+        current.append(paragraph)
+        current_words += words
+    if current or not passages:
+        passages.append("\n".join(current))
+
+    return [
+        {
+            "id": f"{reg['id']}#{n}",
+            "parent": reg["id"],
+            "title": reg["title"],
+            "content": text
+        }
+        for n, text in enumerate(passages)
+    ]
+
+
+def chunk_regulations(regulations, max_words=MAX_PASSAGE_WORDS):
+    passages = []
+    for reg in regulations:
+        passages.extend(chunk_regulation(reg, max_words))
+    return passages
+
+
+def group_by_parent(passages, regulations_by_id, rows, n_results):
+    """
+    Turns ranked passage rows into at most `n_results` distinct parent sections, in rank order.
+    Each returned section is a copy with the passages that matched under `matched_passages`.
+    """
+    sections = []
+    by_parent = {}
+    for row in rows:
+        if row < 0 or row >= len(passages):
+            continue
+        passage = passages[row]
+        parent_id = passage["parent"]
+        if parent_id not in by_parent:
+            if len(sections) >= n_results or parent_id not in regulations_by_id:
+                continue
+            section = dict(regulations_by_id[parent_id])
+            section["matched_passages"] = []
+            by_parent[parent_id] = section
+            sections.append(section)
+        by_parent[parent_id]["matched_passages"].append(passage["content"])
+    return sections
+
+
+def merge_sections(section_lists, n_results, k=60):
+    """
+    Merges several ranked lists of sections from `group_by_parent` with reciprocal rank
+    fusion, combining the matched passages of sections found by more than one list.
+    """
+    scores = {}
+    merged = {}
+    for sections in section_lists:
+        for rank, section in enumerate(sections):
+            scores[section["id"]] = scores.get(section["id"], 0.0) + 1.0 / (k + rank + 1)
+            if section["id"] not in merged:
+                merged[section["id"]] = dict(section, matched_passages=list(section.get("matched_passages", [])))
+                continue
+            known = merged[section["id"]]["matched_passages"]
+            known.extend(p for p in section.get("matched_passages", []) if p not in known)
+    ranked = sorted(merged, key=lambda section_id: scores[section_id], reverse=True)
+    return [merged[section_id] for section_id in ranked[:n_results]]
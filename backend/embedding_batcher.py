@@ -0,0 +1,101 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", 32))
+MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", 5))
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces query texts from concurrent requests into batched encoder calls.
+    A single background worker takes the first waiting text, collects more for up to
+    `max_wait_ms` (or until `max_batch_size`), encodes them in one forward pass and
+    resolves each caller's future. `encode()` is a drop-in for `encoder.encode()`.
+    """
+
+    def __init__(self, encoder, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = {}
+        self._queue_time_total = 0.0
+        self._queue_time_max = 0.0
+        self._encode_time_total = 0.0
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        """Queues one text and returns a Future resolving to its embedding vector."""
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, texts):
+        futures = [self.submit(text) for text in texts]
+        return np.vstack([future.result() for future in futures]).astype('float32')
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                embeddings = np.asarray(self.encoder.encode([text for text, _, _ in batch]), dtype='float32')
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for row, (_, future, _) in enumerate(batch):
+                future.set_result(embeddings[row])
+            self._record(batch, started, finished)
+
+    def _record(self, batch, started, finished):
+        queue_times = [started - queued_at for _, _, queued_at in batch]
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            self._queue_time_total += sum(queue_times)
+            self._queue_time_max = max(self._queue_time_max, max(queue_times))
+            self._encode_time_total += finished - started
+
+    def stats(self):
+        """Batch-size histogram and queue/encode timings, for the health endpoint."""
+        with self._lock:
+            batches = self._batches or 1
+            items = self._items or 1
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "queries": self._items,
+                "mean_batch_size": self._items / batches,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "mean_queue_ms": self._queue_time_total / items * 1000,
+                "max_queue_ms": self._queue_time_max * 1000,
+                "mean_encode_ms": self._encode_time_total / batches * 1000,
+                "pending": self._queue.qsize()
+            }
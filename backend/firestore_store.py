@@ -0,0 +1,419 @@
+import contextvars
+import copy
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# Firestore rejects batches with more than 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+# Seconds the regulations collection is served from memory; the snapshot listener clears it sooner on writes
+REGULATIONS_CACHE_TTL = float(os.environ.get("REGULATIONS_CACHE_TTL", 300))
+
+_request_round_trips = contextvars.ContextVar("firestore_round_trips", default=None)
+
+
+def start_request_count():
+    """Starts counting Firestore round trips for the current request; returns the counter."""
+    counter = {"round_trips": 0}
+    _request_round_trips.set(counter)
+    return counter
+
+
+def request_round_trips():
+    counter = _request_round_trips.get()
+    return counter["round_trips"] if counter else 0
+
+
+def _doc_dict(doc):
+    data = doc.to_dict()
+    data.setdefault("id", doc.id)
+    return data
+
+
+def commit_batched(db, operations, limit=FIRESTORE_BATCH_LIMIT):
+    """
+    Commits ("set" | "merge" | "update" | "delete", ref, data) operations in batches of at
+    most `limit`. Returns the number of commits.
+    """
+    commits = 0
+    for start in range(0, len(operations), limit):
+        batch = db.batch()
+        for op, ref, data in operations[start:start + limit]:
+            if op == "set":
+                batch.set(ref, data)
+            elif op == "merge":
+                batch.set(ref, data, merge=True)
+            elif op == "update":
+                batch.update(ref, data)
+            else:
+                batch.delete(ref)
+        batch.commit()
+        commits += 1
+    return commits
+
+
+class FirestoreStore:
+    """
+    Data access for the app's Firestore collections. Reads are batched with get_all, writes
+    with batched commits, and the mostly-static `regulations` collection is served from a
+    TTL read-through cache that a snapshot listener clears whenever the collection changes.
+    Every round trip is counted, in total and for the current request.
+    """
+
+    def __init__(self, db, regulations_ttl=REGULATIONS_CACHE_TTL):
+        self.db = db
+        self.regulations_ttl = regulations_ttl
+        self.round_trips = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._regulations = None
+        self._regulations_expires = 0.0
+        self._listener = None
+        self._generation = 0
+        self._initial_snapshot = True
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def _count(self, n=1):
+        with self._lock:
+            self.round_trips += n
+        counter = _request_round_trips.get()
+        if counter is not None:
+            counter["round_trips"] += n
+
+    def get(self, collection, doc_id):
+        """Returns the document as a dict, or None if it does not exist."""
+        self._count()
+        doc = self.db.collection(collection).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_many(self, collection, doc_ids):
+        """Returns {id: dict} for the documents that exist, read in one get_all round trip."""
+        if not doc_ids:
+            return {}
+        self._count()
+        refs = [self.db.collection(collection).document(doc_id) for doc_id in doc_ids]
+        return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+    def query(self, collection, filters=(), order_by=None, descending=False, limit=None, start_after=None):
+        """
+        Runs a query and returns the matching documents as dicts with their `id`. `order_by`
+        is a field or a list of fields; `start_after` maps them to a cursor document's values.
+        """
+        query = self.db.collection(collection)
+        for field, op, value in filters:
+            query = query.where(field, op, value)
+        for field in [order_by] if isinstance(order_by, str) else order_by or []:
+            query = query.order_by(field, direction="DESCENDING" if descending else "ASCENDING")
+        if start_after:
+            query = query.start_after(start_after)
+        if limit:
+            query = query.limit(limit)
+        self._count()
+        return [_doc_dict(doc) for doc in query.stream()]
+
+    def set(self, collection, doc_id, data, merge=False):
+        self._count()
+        self.db.collection(collection).document(doc_id).set(data, merge=merge)
+
+    def add(self, collection, data):
+        self._count()
+        return self.db.collection(collection).add(data)
+
+    def write(self, operations):
+        """
+        Commits (op, collection, doc_id, data) operations in batches of up to 500. A doc_id of
+        None adds a new document. Returns the number of commits.
+        """
+        refs = []
+        for op, collection, doc_id, data in operations:
+            collection_ref = self.db.collection(collection)
+            ref = collection_ref.document(doc_id) if doc_id else collection_ref.document()
+            refs.append((op, ref, data))
+        commits = commit_batched(self.db, refs)
+        self._count(commits)
+        return commits
+
+    def add_many(self, collection, records):
+        return self.write([("set", collection, None, record) for record in records])
+
+    def regulations(self, category=None):
+        """
+        All regulations (optionally of one category) from the read-through cache. Returns
+        shallow copies, so callers may annotate them.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._regulations if self._regulations_expires > now else None
+            if cached is not None:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        if cached is None:
+            self._watch_regulations()
+            generation = self._generation
+            self._count()
+            cached = [_doc_dict(doc) for doc in self.db.collection('regulations').stream()]
+            with self._lock:
+                # Don't keep a read that raced with a write the listener already reported
+                if generation == self._generation:
+                    self._regulations = cached
+                    self._regulations_expires = now + self.regulations_ttl
+        return [dict(reg) for reg in cached if not category or reg.get('category') == category]
+
+    def invalidate_regulations(self, *args):
+        with self._lock:
+            if self._initial_snapshot and args:
+                # A new listener first delivers the current contents, which is not a change
+                self._initial_snapshot = False
+                return
+            self._generation += 1
+            self._regulations = None
+            self._regulations_expires = 0.0
+            subscribers = list(self._subscribers)
+        changes = args[1] if len(args) > 1 else []
+        if not changes:
+            return
+        upserted = [_doc_dict(change.document) for change in changes if change.type.name != "REMOVED"]
+        removed = [change.document.id for change in changes if change.type.name == "REMOVED"]
+        for callback in subscribers:
+            try:
+                callback(upserted, removed)
+            except Exception as e:
+                print(f"Error applying regulation changes: {e}")
+
+    def on_regulation_changes(self, callback):
+        """
+        Calls `callback(upserted regulations, removed ids)` for every change the snapshot
+        listener reports, so derived in-memory indexes can be updated incrementally.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+        self._watch_regulations()
+
+    def _watch_regulations(self):
+        if self._listener is not None:
+            return
+        try:
+            self._listener = self.db.collection('regulations').on_snapshot(self.invalidate_regulations)
+        except Exception as e:
+            # Without a listener the cache still expires after its TTL
+            print(f"Could not watch regulations collection: {e}")
+            self._listener = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "round_trips": self.round_trips,
+                "regulations_cache": {
+                    "cached": self._regulations is not None,
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "ttl_seconds": self.regulations_ttl,
+                    "listener": bool(self._listener)
+                }
+            }
+
+
+def _resolve(value):
+    # firestore.SERVER_TIMESTAMP is a Sentinel; the stand-in stores the write time instead
+    if type(value).__name__ == "Sentinel":
+        return datetime.now(timezone.utc)
+    return value
+
+
+class MemoryDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class MemoryDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        with self._collection.db.lock:
+            return MemoryDocumentSnapshot(self, self._collection.docs.get(self.id))
+
+    def set(self, data, merge=False):
+        data = {key: _resolve(value) for key, value in data.items()}
+        with self._collection.db.lock:
+            existed = self.id in self._collection.docs
+            if merge and existed:
+                self._collection.docs[self.id].update(copy.deepcopy(data))
+            else:
+                self._collection.docs[self.id] = copy.deepcopy(data)
+        self._collection.notify(self, "MODIFIED" if existed else "ADDED")
+
+    def update(self, data):
+        with self._collection.db.lock:
+            if self.id not in self._collection.docs:
+                raise KeyError(f"No document to update: {self._collection.name}/{self.id}")
+        self.set(data, merge=True)
+
+    def delete(self):
+        with self._collection.db.lock:
+            data = self._collection.docs.pop(self.id, None)
+        if data is not None:
+            self._collection.notify(self, "REMOVED", MemoryDocumentSnapshot(self, data))
+
+
+class MemoryQuery:
+    OPERATORS = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b,
+        "array_contains": lambda a, b: b in (a or []),
+    }
+
+    def __init__(self, collection, filters=(), orders=(), limit_to=None, cursor=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit_to
+        self._cursor = cursor
+
+    def _with(self, **changes):
+        fields = {"filters": self._filters, "orders": self._orders, "limit_to": self._limit, "cursor": self._cursor}
+        fields.update(changes)
+        return MemoryQuery(self._collection, **fields)
+
+    def where(self, field, op, value):
+        return self._with(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._with(orders=self._orders + [(field, direction)])
+
+    def limit(self, count):
+        return self._with(limit_to=count)
+
+    def start_after(self, values):
+        """`values` maps each order_by field to the last document's value, like Firestore."""
+        return self._with(cursor=values)
+
+    def _after_cursor(self, data):
+        for field, direction in self._orders:
+            value, cursor = data[field], self._cursor[field]
+            if value != cursor:
+                return value < cursor if str(direction).upper().endswith("DESCENDING") else value > cursor
+        return False
+
+    def stream(self):
+        with self._collection.db.lock:
+            items = list(self._collection.docs.items())
+        for field, op, value in self._filters:
+            items = [(doc_id, data) for doc_id, data in items if self.OPERATORS[op](data.get(field), value)]
+        for field, direction in reversed(self._orders):
+            items = [(doc_id, data) for doc_id, data in items if data.get(field) is not None]
+            items.sort(key=lambda item: item[1][field], reverse=str(direction).upper().endswith("DESCENDING"))
+        if self._cursor is not None:
+            items = [(doc_id, data) for doc_id, data in items if self._after_cursor(data)]
+        if self._limit is not None:
+            items = items[:self._limit]
+        for doc_id, data in items:
+            yield MemoryDocumentSnapshot(self._collection.document(doc_id), copy.deepcopy(data))
+
+    def get(self):
+        return list(self.stream())
+
+
+class MemoryWatch:
+    def __init__(self, collection, callback):
+        self._collection = collection
+        self.callback = callback
+
+    def unsubscribe(self):
+        self._collection.listeners.remove(self)
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, db, name):
+        super().__init__(self)
+        self.db = db
+        self.name = name
+        self.docs = {}
+        self.listeners = []
+
+    def document(self, doc_id=None):
+        return MemoryDocumentReference(self, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+    def on_snapshot(self, callback):
+        watch = MemoryWatch(self, callback)
+        self.listeners.append(watch)
+        # Like Firestore, the first callback carries the current contents
+        callback(self.get(), [], datetime.now(timezone.utc))
+        return watch
+
+    def notify(self, ref, change_type, document=None):
+        # Listeners get the changed document only, with a DocumentChange-like record of it
+        document = document or ref.get()
+        change = SimpleNamespace(type=SimpleNamespace(name=change_type), document=document)
+        for watch in list(self.listeners):
+            watch.callback([document], [change], datetime.now(timezone.utc))
+
+
+class MemoryBatch:
+    def __init__(self, db):
+        self.db = db
+        self._operations = []
+
+    def set(self, ref, data, merge=False):
+        self._operations.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, data):
+        self._operations.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._operations.append(ref.delete)
+
+    def commit(self):
+        if len(self._operations) > FIRESTORE_BATCH_LIMIT:
+            raise ValueError(f"Batch has {len(self._operations)} operations; the limit is {FIRESTORE_BATCH_LIMIT}")
+        for operation in self._operations:
+            operation()
+        self._operations = []
+
+
+class MemoryFirestore:
+    """
+    In-process stand-in for the subset of the Firestore client the app uses, so the API
+    can run, be tested and be benchmarked without a Firebase project (FIRESTORE_BACKEND=memory).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._collections = {}
+
+    def collection(self, name):
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def batch(self):
+        return MemoryBatch(self)
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
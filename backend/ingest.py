@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import numpy as np
+
+from firestore_store import commit_batched
+from regulation_store import section_hash
+
+INGEST_STATE_DOC = ('ingest_state', 'regulations')
+# Bump when the stored regulation fields change so the next ingest rewrites every section
+REGULATION_SCHEMA_VERSION = 2
+
+
+def diff_regulations(previous_hashes, regulations):
+    """
+    Compares parsed regulations against previously stored {id: hash} pairs.
+    Returns a change log with added, modified, removed and unchanged ids.
+    """
+    changes = {"added": [], "modified": [], "removed": [], "unchanged": 0}
+    current_ids = set()
+    for reg in regulations:
+        reg["hash"] = reg.get("hash") or section_hash(reg)
+        current_ids.add(reg["id"])
+        old_hash = previous_hashes.get(reg["id"])
+        if old_hash is None:
+            changes["added"].append(reg["id"])
+        elif old_hash != reg["hash"]:
+            changes["modified"].append(reg["id"])
+        else:
+            changes["unchanged"] += 1
+    changes["removed"] = sorted(set(previous_hashes) - current_ids)
+    return changes
+
+
+def has_changes(changes):
+    return bool(changes["added"] or changes["modified"] or changes["removed"])
+
+
+def load_ingest_state(db):
+    """Reads the state document of the last ingest (hash manifest, schema version) in one round trip."""
+    try:
+        doc = db.collection(INGEST_STATE_DOC[0]).document(INGEST_STATE_DOC[1]).get()
+    except Exception as e:
+        print(f"Error reading ingest state: {e}")
+        return {}
+    return doc.to_dict() if doc.exists else {}
+
+
+def write_changes(db, regulations, changes, ecfr_date=None, rewrite_all=False):
+    """
+    Writes only added/modified sections and deletes removed ones using batched commits,
+    then stores the new hash manifest and the change log. `rewrite_all` also rewrites
+    unchanged sections, e.g. to backfill a new field. Returns the number of commits.
+    """
+    if not has_changes(changes) and not rewrite_all:
+        return 0
+
+    by_id = {reg["id"]: reg for reg in regulations}
+    written = by_id if rewrite_all else changes["added"] + changes["modified"]
+    operations = []
+    for reg_id in written:
+        operations.append(("set", db.collection('regulations').document(reg_id), by_id[reg_id]))
+    for reg_id in changes["removed"]:
+        operations.append(("delete", db.collection('regulations').document(reg_id), None))
+
+    state_ref = db.collection(INGEST_STATE_DOC[0]).document(INGEST_STATE_DOC[1])
+    operations.append(("set", state_ref, {
+        "hashes": {reg["id"]: reg["hash"] for reg in regulations},
+        "ecfr_date": ecfr_date,
+        "schema_version": REGULATION_SCHEMA_VERSION,
+        "updated_at": datetime.now().isoformat()
+    }))
+    operations.append(("set", db.collection('regulation_changes').document(), change_log_entry(changes, ecfr_date)))
+
+    return commit_batched(db, operations)
+
+
+def change_log_entry(changes, ecfr_date=None):
+    return {
+        "ecfr_date": ecfr_date,
+        "added": changes["added"],
+        "modified": changes["modified"],
+        "removed": changes["removed"],
+        "unchanged": changes["unchanged"],
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def apply_index_changes(index, previous_regulations, regulations, embeddings, changes):
+    """
+    Brings the FAISS index in line with the new corpus.
+    Index ids are row numbers in `regulations`. When the row layout is unchanged only the
+    modified rows are replaced; otherwise the index is rebuilt from the cached embeddings.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    same_layout = (
+        index.ntotal == len(regulations)
+        and [r["id"] for r in previous_regulations or []] == [r["id"] for r in regulations]
+    )
+
+    if same_layout and hasattr(index, "remove_ids"):
+        if not changes["modified"]:
+            return 0
+        row_of = {reg["id"]: row for row, reg in enumerate(regulations)}
+        rows = np.array([row_of[reg_id] for reg_id in changes["modified"]], dtype='int64')
+        try:
+            index.remove_ids(rows)
+            index.add_with_ids(embeddings[rows], rows)
+            return len(rows)
+        except RuntimeError as e:
+            print(f"Partial index update failed, rebuilding: {e}")
+
+    index.reset()
+    rows = np.arange(len(regulations), dtype='int64')
+    if hasattr(index, "add_with_ids"):
+        index.add_with_ids(embeddings, rows)
+    else:
+        index.add(embeddings)
+    return len(rows)
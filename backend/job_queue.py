@@ -0,0 +1,150 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Gemini requests per minute shared by all background jobs in this process
+GEMINI_RPM = float(os.environ.get("GEMINI_RPM", 10))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 4))
+JOB_BACKOFF_SECONDS = float(os.environ.get("JOB_BACKOFF_SECONDS", 2))
+# Done and failed jobs are forgotten after this many seconds, or oldest first beyond the cap
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 3600))
+JOB_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", 10000))
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class JobQueue:
+    """
+    Worker-pool queue for slow background jobs such as Gemini calls. Jobs are keyed, so
+    submitting a key that is queued, running or done is a no-op. Failed attempts are retried
+    with exponential backoff and jitter, up to `max_attempts`. `handler(payload)` returns the
+    job's result, which stays available through `result(key)` for `result_ttl` seconds;
+    after that the key is forgotten and submitting it again runs the job again.
+    """
+
+    def __init__(self, handler, workers=JOB_WORKERS, bucket=None,
+                 max_attempts=JOB_MAX_ATTEMPTS, backoff=JOB_BACKOFF_SECONDS, name="jobs",
+                 result_ttl=JOB_RESULT_TTL, max_finished=JOB_MAX_FINISHED):
+        self.handler = handler
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        # Keys of done and failed jobs in the order they finished, for eviction
+        self._finished = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for n in range(workers):
+            threading.Thread(target=self._work, name=f"{name}-{n}", daemon=True).start()
+
+    def submit(self, key, payload):
+        """Queues `payload` under `key` unless that key is already known. Returns its status."""
+        with self._lock:
+            self._evict()
+            job = self.jobs.get(key)
+            if job and job["status"] != "failed":
+                return job["status"]
+            self._finished.pop(key, None)
+            self.jobs[key] = {"status": "queued", "attempts": 0, "result": None, "error": None}
+        self._queue.put((key, payload))
+        return "queued"
+
+    def status(self, key):
+        with self._lock:
+            job = self.jobs.get(key)
+            return job["status"] if job else None
+
+    def result(self, key):
+        with self._lock:
+            job = self.jobs.get(key)
+            return job["result"] if job and job["status"] == "done" else None
+
+    def progress(self, keys=None):
+        """Counts of jobs per status, over `keys` if given."""
+        with self._lock:
+            self._evict()
+            jobs = self.jobs.values() if keys is None else [self.jobs[k] for k in keys if k in self.jobs]
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in jobs:
+                counts[job["status"]] += 1
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def _work(self):
+        while True:
+            key, payload = self._queue.get()
+            with self._lock:
+                job = self.jobs[key]
+                job["status"] = "running"
+                job["attempts"] += 1
+            if self.bucket:
+                self.bucket.acquire()
+            try:
+                result = self.handler(payload)
+            except Exception as e:
+                self._retry_or_fail(key, payload, job, e)
+            else:
+                with self._lock:
+                    job.update(status="done", result=result, error=None)
+                    self._finish(key)
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, key):
+        # Called with the lock held
+        self._finished[key] = time.monotonic()
+        self._finished.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        # Called with the lock held; finished keys are in finish order, so only the front is checked
+        expired = time.monotonic() - self.result_ttl
+        while self._finished:
+            key, finished = next(iter(self._finished.items()))
+            if finished > expired and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[key]
+            self.jobs.pop(key, None)
+
+    def _retry_or_fail(self, key, payload, job, error):
+        with self._lock:
+            job["error"] = str(error)
+            if job["attempts"] >= self.max_attempts:
+                job["status"] = "failed"
+                self._finish(key)
+                print(f"Job {key} failed after {job['attempts']} attempts: {error}")
+                return
+            job["status"] = "queued"
+            delay = self.backoff * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.5)
+        print(f"Job {key} attempt {job['attempts']} failed ({error}); retrying in {delay:.1f}s")
+        timer = threading.Timer(delay, self._queue.put, args=((key, payload),))
+        timer.daemon = True
+        timer.start()
@@ -0,0 +1,79 @@
+import re
+import time
+
+import numpy as np
+
+# Section numbers like "135.89" or "91.1001" stay single tokens so exact citations match
+TOKEN_RE = re.compile(r"\d+(?:\.\d+)*[a-z]?|[a-z][a-z0-9]*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is",
+    "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "which", "with",
+    "what", "when", "who", "how", "does", "do", "i", "my", "we", "our", "any", "must", "shall"
+}
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def document_text(doc):
+    return f"{doc.get('parent', doc['id'])} {doc.get('title') or ''} {doc.get('content') or ''}"
+
+
+class BM25Index:
+    """
+    In-memory inverted index with BM25 scoring. Per-posting BM25 weights are precomputed
+    at build time, so a query is a handful of numpy scatter-adds over its postings.
+    """
+
+    def __init__(self, docs, k1=1.2, b=0.75):
+        started = time.perf_counter()
+        self.size = len(docs)
+        lengths = np.zeros(self.size, dtype='float32')
+        term_freqs = {}
+        for row, doc in enumerate(docs):
+            tokens = tokenize(document_text(doc))
+            lengths[row] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_freqs.setdefault(token, []).append((row, count))
+
+        avg_length = float(lengths.mean()) if self.size else 0.0
+        norm = k1 * (1 - b + b * lengths / (avg_length or 1.0))
+        self.postings = {}
+        for token, entries in term_freqs.items():
+            rows = np.fromiter((row for row, _ in entries), dtype='int64', count=len(entries))
+            tf = np.fromiter((count for _, count in entries), dtype='float32', count=len(entries))
+            idf = np.log(1 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[token] = (rows, (idf * tf * (k1 + 1) / (tf + norm[rows])).astype('float32'))
+        self.build_seconds = time.perf_counter() - started
+
+    def search(self, query, k=10):
+        """Returns up to `k` (row, score) pairs, best first. `k=None` returns every match."""
+        terms = [t for t in set(tokenize(query)) if t in self.postings]
+        if not terms:
+            return []
+        scores = np.zeros(self.size, dtype='float32')
+        for term in terms:
+            rows, weights = self.postings[term]
+            scores[rows] += weights
+
+        matched = np.flatnonzero(scores)
+        if k is not None and k < len(matched):
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(int(row), float(scores[row])) for row in matched]
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """Fuses several ranked lists of rows into one, scoring each row by sum(1 / (k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            if row < 0:
+                continue
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank + 1)
+    fused = sorted(scores, key=lambda row: scores[row], reverse=True)
+    return fused[:limit] if limit else fused
@@ -0,0 +1,85 @@
+"""
+Concurrent-request load test for the Flinsight API.
+
+Fires requests at increasing concurrency levels and reports throughput and latency
+percentiles, e.g. to compare `python app.py` against `python serve.py`:
+
+    python load_test.py --url http://localhost:5000 --endpoint chat --levels 1,8,32,64
+
+Start the app with FIRESTORE_BACKEND=memory to benchmark without a Firebase project. The
+mean Firestore round trips per request (X-Firestore-Round-Trips) are reported as well.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PAYLOADS = {
+    "analyze-flight": ("POST", "/api/analyze-flight", {
+        "departure": "KTEB", "arrival": "EGLL", "aircraft": "Gulfstream 550",
+        "date": "2025-04-15", "passengers": 8
+    }),
+    "chat": ("POST", "/api/chat", {"message": "What are the oxygen requirements above FL250?"}),
+    "weather": ("POST", "/api/weather_at", {"departure": "KTEB", "arrival": "KJFK"}),
+    "health": ("GET", "/api/health", None),
+    "regulations": ("GET", "/api/regulations?category=regulation", None),
+    "faa-updates": ("GET", "/api/fetch-faa-updates", None),
+}
+
+
+def run_level(url, endpoint, concurrency, requests_per_level, timeout):
+    method, path, payload = PAYLOADS[endpoint]
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url + path, json=payload, timeout=timeout)
+            ok = response.status_code < 500
+            round_trips = int(response.headers.get("X-Firestore-Round-Trips", 0))
+        except requests.exceptions.RequestException:
+            ok, round_trips = False, 0
+        return ok, time.perf_counter() - started, round_trips
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests_per_level)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds for ok, seconds, _ in results if ok)
+    errors = sum(1 for ok, _, _ in results if not ok)
+    if not latencies:
+        return {"concurrency": concurrency, "errors": errors, "rps": 0.0}
+    return {
+        "concurrency": concurrency,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        "errors": errors,
+        "round_trips": sum(trips for ok, _, trips in results if ok) / len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--endpoint", choices=sorted(PAYLOADS), default="chat")
+    parser.add_argument("--levels", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=None, help="requests per level (default 4x concurrency)")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    print(f"{'conc':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7} {'fs trips':>9}")
+    for level in (int(l) for l in args.levels.split(",")):
+        stats = run_level(args.url, args.endpoint, level, args.requests or level * 4, args.timeout)
+        print(f"{stats['concurrency']:>5} {stats['rps']:>8.2f} {stats.get('p50_ms', 0):>9.0f} "
+              f"{stats.get('p95_ms', 0):>9.0f} {stats['errors']:>7} {stats.get('round_trips', 0):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 2048))
+# Optional SQLite file shared by all workers on a host, e.g. /var/cache/flinsight/queries.db
+QUERY_CACHE_DB = os.environ.get("QUERY_CACHE_DB")
+QUERY_CACHE_DB_ROWS = int(os.environ.get("QUERY_CACHE_DB_ROWS", 50000))
+
+
+def normalize_query(query):
+    """Lower-cases, collapses whitespace and trims punctuation so trivially different queries share an entry."""
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" ?!.,;:")
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU map with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class SqliteTier:
+    """
+    Shared on-disk second tier so workers on one host re-use each other's work.
+    Rows are evicted by last use once the table grows past `max_rows`.
+    """
+
+    def __init__(self, path, max_rows=QUERY_CACHE_DB_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, used REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with conn:
+                conn.execute("UPDATE cache SET used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+        except sqlite3.Error as e:
+            print(f"Query cache read error: {e}")
+            return None
+
+    def put(self, key, value):
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, time.time()))
+                count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+                if count > self.max_rows:
+                    conn.execute(
+                        "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)",
+                        (count - self.max_rows,)
+                    )
+        except sqlite3.Error as e:
+            print(f"Query cache write error: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class QueryCache:
+    """
+    Memoizes normalized query -> embedding and (embedding, k, index version) -> passage rows.
+    Results keyed by an old index version are never returned, and `invalidate()` drops them
+    from memory when the index is rebuilt.
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, db_path=QUERY_CACHE_DB):
+        self.embeddings = LRUCache(maxsize)
+        self.results = LRUCache(maxsize)
+        self.shared = SqliteTier(db_path) if db_path else None
+
+    def embedding(self, query, compute):
+        """Returns the embedding for `query`, calling `compute(query)` on a miss."""
+        normalized = normalize_query(query)
+        key = "emb:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        vector = self.embeddings.get(key)
+        if vector is not None:
+            return vector
+
+        if self.shared:
+            blob = self.shared.get(key)
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype='float32')
+                self.embeddings.put(key, vector)
+                return vector
+
+        vector = np.ascontiguousarray(compute(normalized), dtype='float32').reshape(-1)
+        vector.setflags(write=False)
+        self.embeddings.put(key, vector)
+        if self.shared:
+            self.shared.put(key, vector.tobytes())
+        return vector
+
+    def embedding_many(self, queries, compute_many):
+        """
+        Embeddings for several queries as an (N, dim) array. Cache misses are passed together
+        to `compute_many(normalized_queries)`, so they are encoded in one forward pass.
+        """
+        vectors = [None] * len(queries)
+        missing = {}
+        for position, query in enumerate(queries):
+            normalized = normalize_query(query)
+            key = "emb:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+            vector = self.embeddings.get(key)
+            if vector is None and self.shared:
+                blob = self.shared.get(key)
+                if blob is not None:
+                    vector = np.frombuffer(blob, dtype='float32')
+                    self.embeddings.put(key, vector)
+            if vector is None:
+                missing.setdefault(normalized, (key, []))[1].append(position)
+            vectors[position] = vector
+
+        if missing:
+            computed = np.asarray(compute_many(list(missing)), dtype='float32')
+            for row, (key, positions) in zip(computed, missing.values()):
+                vector = np.ascontiguousarray(row)
+                vector.setflags(write=False)
+                self.embeddings.put(key, vector)
+                if self.shared:
+                    self.shared.put(key, vector.tobytes())
+                for position in positions:
+                    vectors[position] = vector
+        return np.vstack(vectors).astype('float32') if vectors else np.zeros((0, 0), dtype='float32')
+
+    def search(self, vector, k, index_version, compute):
+        """Returns the cached result rows for this embedding, calling `compute()` on a miss."""
+        digest = hashlib.sha1(np.ascontiguousarray(vector, dtype='float32').tobytes()).hexdigest()
+        key = f"res:{index_version}:{k}:{digest}"
+        rows = self.results.get(key)
+        if rows is not None:
+            return rows
+
+        if self.shared:
+            blob = self.shared.get(key)
+            if blob is not None:
+                rows = json.loads(blob)
+                self.results.put(key, rows)
+                return rows
+
+        rows = [int(row) for row in compute()]
+        self.results.put(key, rows)
+        if self.shared:
+            self.shared.put(key, json.dumps(rows))
+        return rows
+
+    def invalidate(self):
+        """Drops cached results after the regulation index is rebuilt; embeddings stay valid."""
+        self.results.clear()
+
+    def stats(self):
+        stats = {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
+        if self.shared:
+            stats["shared"] = self.shared.stats()
+        return stats
@@ -0,0 +1,221 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+
+from keyword_index import BM25Index
+
+# Seconds a keyword index rebuild waits after a change, so a burst of listener updates costs one build
+KEYWORD_REBUILD_DELAY = 1.0
+
+
+def _digest(reg):
+    payload = json.dumps(reg, sort_keys=True, separators=(",", ":"), default=str)
+    return int.from_bytes(hashlib.sha1(payload.encode("utf-8")).digest(), "big")
+
+
+def encode_cursor(offset, last_id):
+    return base64.urlsafe_b64encode(json.dumps([offset, last_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns (offset, last id); raises ValueError if the cursor is malformed."""
+    try:
+        offset, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return int(offset), last_id
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class RegulationIndex:
+    """
+    Inverted indexes over the regulation list: category -> ids, aircraft ICAO type -> ids,
+    and the set of generally applicable regulations (no aircraft_types). Built once at
+    ingest and kept current with `upsert`/`remove`, so filtering is set intersection.
+
+    Keyword search runs over the same regulations through a BM25 index. Changes schedule a
+    rebuild on a background thread that is swapped in when done; until then searches use the
+    previous index, whose hits are still filtered to the current regulations by `query`.
+
+    `digest` covers the content of every regulation and is order independent (an XOR of
+    per-regulation hashes), so it updates in O(1) per change and is identical across workers
+    holding the same corpus, which makes it usable for ETags.
+    """
+
+    def __init__(self, regulations=()):
+        self._lock = threading.Lock()
+        self._keyword = None
+        self._version = 0
+        self._rebuild_pending = False
+        self.rebuild(regulations)
+
+    def rebuild(self, regulations):
+        with self._lock:
+            self.by_id = {}
+            self.position = {}
+            self.by_category = {}
+            self.by_aircraft = {}
+            self.general = set()
+            self._digests = {}
+            self._digest = 0
+            self._next_position = 0
+            self._version += 1
+            for reg in regulations:
+                self._add(reg)
+        self._schedule_keyword_rebuild()
+
+    def upsert(self, regulations):
+        with self._lock:
+            for reg in regulations:
+                if reg["id"] in self.by_id:
+                    self._remove(reg["id"], keep_position=True)
+                self._add(reg)
+        self._schedule_keyword_rebuild()
+
+    def remove(self, reg_ids):
+        with self._lock:
+            for reg_id in reg_ids:
+                if reg_id in self.by_id:
+                    self._remove(reg_id)
+        self._schedule_keyword_rebuild()
+
+    def update(self, upserted=(), removed=()):
+        self.remove(removed)
+        self.upsert(upserted)
+
+    def apply_changes(self, regulations, changes):
+        """Applies a diff_regulations change log for the new `regulations` list."""
+        by_id = {reg["id"]: reg for reg in regulations}
+        self.update([by_id[reg_id] for reg_id in changes["added"] + changes["modified"] if reg_id in by_id],
+                    changes["removed"])
+
+    def _add(self, reg):
+        reg_id = reg["id"]
+        self.by_id[reg_id] = reg
+        if reg_id not in self.position:
+            self.position[reg_id] = self._next_position
+            self._next_position += 1
+        self.by_category.setdefault(reg.get("category"), set()).add(reg_id)
+        if "aircraft_types" in reg:
+            for aircraft_type in reg.get("aircraft_types") or []:
+                self.by_aircraft.setdefault(aircraft_type, set()).add(reg_id)
+        else:
+            self.general.add(reg_id)
+        self._digests[reg_id] = _digest(reg)
+        self._digest ^= self._digests[reg_id]
+        self._version += 1
+
+    def _remove(self, reg_id, keep_position=False):
+        reg = self.by_id.pop(reg_id)
+        self.by_category.get(reg.get("category"), set()).discard(reg_id)
+        for aircraft_type in reg.get("aircraft_types") or []:
+            self.by_aircraft.get(aircraft_type, set()).discard(reg_id)
+        self.general.discard(reg_id)
+        self._digest ^= self._digests.pop(reg_id)
+        self._version += 1
+        if not keep_position:
+            del self.position[reg_id]
+
+    @property
+    def digest(self):
+        with self._lock:
+            return f"{self._digest:040x}"
+
+    @property
+    def keyword_version(self):
+        """Change count the current keyword index was built at; part of ETags for searches."""
+        with self._lock:
+            return self._keyword[0] if self._keyword else None
+
+    def search(self, query):
+        """BM25 ranks of the indexed regulations matching `query`, as {id: position}."""
+        with self._lock:
+            keyword = self._keyword
+        if keyword is None:
+            # Only before the first background build has finished
+            keyword = self._build_keyword_index()
+        _, ids, keyword_index = keyword
+        return {ids[row]: position for position, (row, _) in enumerate(keyword_index.search(query, k=None))}
+
+    def _build_keyword_index(self):
+        # The lock is held only to snapshot the regulations; BM25 is built outside it
+        with self._lock:
+            version = self._version
+            ids = list(self.by_id)
+            docs = [self.by_id[reg_id] for reg_id in ids]
+        keyword = (version, ids, BM25Index(docs))
+        with self._lock:
+            if self._keyword is None or self._keyword[0] < version:
+                self._keyword = keyword
+        return keyword
+
+    def _schedule_keyword_rebuild(self):
+        with self._lock:
+            if self._rebuild_pending or (self._keyword and self._keyword[0] == self._version):
+                return
+            self._rebuild_pending = True
+        threading.Thread(target=self._rebuild_keyword_index, name="keyword-index", daemon=True).start()
+
+    def _rebuild_keyword_index(self):
+        time.sleep(KEYWORD_REBUILD_DELAY)
+        with self._lock:
+            self._rebuild_pending = False
+        try:
+            self._build_keyword_index()
+        except Exception as e:
+            print(f"Keyword index rebuild failed: {e}")
+
+    def _ordered(self, ids):
+        return sorted(ids, key=self.position.__getitem__)
+
+    def query(self, category=None, aircraft_type=None, prioritize=None, rank=None):
+        """
+        Ids matching the filters, in ingest order:
+        - `aircraft_type`: regulations for that type first, then the generally applicable ones;
+        - otherwise `prioritize` (a type, e.g. "GLF5") moves that type's regulations to the front;
+        - `rank` ({id: position}, e.g. from BM25) keeps only ranked ids, in rank order.
+        """
+        with self._lock:
+            base = self.by_category.get(category, set()) if category else set(self.by_id)
+            if aircraft_type:
+                ids = (self._ordered(base & self.by_aircraft.get(aircraft_type, set()))
+                       + self._ordered(base & self.general))
+            elif prioritize:
+                preferred = base & self.by_aircraft.get(prioritize, set())
+                ids = self._ordered(preferred) + self._ordered(base - preferred)
+            else:
+                ids = self._ordered(base)
+        if rank is not None:
+            ids = sorted((reg_id for reg_id in ids if reg_id in rank), key=rank.__getitem__)
+        return ids
+
+    def page(self, ids, cursor=None, limit=None):
+        """
+        Slices a query result. The cursor carries the offset and the last id returned, so a
+        page resumes after that id even if regulations were added or removed in between (at the
+        same offset if that id itself was removed). Returns (regulations, next cursor).
+        """
+        start = 0
+        if cursor:
+            offset, last_id = decode_cursor(cursor)
+            if 0 < offset <= len(ids) and ids[offset - 1] == last_id:
+                start = offset
+            elif last_id in ids:
+                start = ids.index(last_id) + 1
+            else:
+                start = min(offset, len(ids))
+        end = len(ids) if not limit else min(start + limit, len(ids))
+        with self._lock:
+            page = [self.by_id[reg_id] for reg_id in ids[start:end] if reg_id in self.by_id]
+        next_cursor = encode_cursor(end, ids[end - 1]) if end < len(ids) and end > start else None
+        return page, next_cursor
+
+    def stats(self):
+        with self._lock:
+            return {
+                "regulations": len(self.by_id),
+                "categories": {str(category): len(ids) for category, ids in self.by_category.items()},
+                "aircraft_types": len(self.by_aircraft),
+                "general": len(self.general)
+            }
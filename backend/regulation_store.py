@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from chunking import chunk_regulations
+
+# Snapshots live next to the backend unless REGULATION_CACHE_DIR says otherwise
+CACHE_DIR = os.environ.get(
+    "REGULATION_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "regulation_cache")
+)
+SNAPSHOT_VERSION = 2
+
+
+def regulation_text(reg):
+    """Text that gets embedded for a regulation or passage (passages use their section id)."""
+    return f"{reg.get('parent', reg['id'])} {reg['title']} {reg['content']}"
+
+
+def section_hash(reg):
+    """Content hash of a regulation section, used to detect changed sections."""
+    return hashlib.sha256(regulation_text(reg).encode("utf-8")).hexdigest()
+
+
+def corpus_hash(regulations):
+    """Hash of the whole corpus, derived from the per-section hashes."""
+    digest = hashlib.sha256()
+    for reg in regulations:
+        digest.update((reg.get("hash") or section_hash(reg)).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def _pointer_path(ecfr_date, cache_dir):
+    return os.path.join(cache_dir, f"{ecfr_date}.json")
+
+
+def _snapshot_dir(name, cache_dir):
+    return os.path.join(cache_dir, name)
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(ecfr_date, cache_dir=CACHE_DIR):
+    """
+    Loads the current snapshot for an eCFR date.
+    Returns (regulations, passages, embeddings) with one embedding row per passage,
+    memory-mapped read-only, or None if there is no usable snapshot.
+    """
+    try:
+        with open(_pointer_path(ecfr_date, cache_dir), encoding="utf-8") as f:
+            pointer = json.load(f)
+        if pointer.get("version") != SNAPSHOT_VERSION:
+            return None
+        snapshot_dir = _snapshot_dir(pointer["snapshot"], cache_dir)
+        with open(os.path.join(snapshot_dir, "regulations.json"), encoding="utf-8") as f:
+            regulations = json.load(f)
+        with open(os.path.join(snapshot_dir, "passages.json"), encoding="utf-8") as f:
+            passages = json.load(f)
+        embeddings = np.load(os.path.join(snapshot_dir, "embeddings.npy"), mmap_mode="r")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"No usable regulation snapshot for {ecfr_date}: {e}")
+        return None
+
+    if len(passages) != embeddings.shape[0]:
+        print(f"Regulation snapshot for {ecfr_date} is inconsistent, ignoring it")
+        return None
+    return regulations, passages, embeddings
+
+
+def snapshot_dir(ecfr_date, cache_dir=CACHE_DIR):
+    """Directory of the current snapshot for an eCFR date, or None."""
+    try:
+        with open(_pointer_path(ecfr_date, cache_dir), encoding="utf-8") as f:
+            return _snapshot_dir(json.load(f)["snapshot"], cache_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_snapshot(ecfr_date, regulations, passages, embeddings, cache_dir=CACHE_DIR):
+    """
+    Writes a snapshot keyed by eCFR date and corpus hash and points the date at it.
+    Returns the snapshot name.
+    """
+    name = f"{ecfr_date}-{corpus_hash(regulations)[:16]}"
+    snapshot_dir = _snapshot_dir(name, cache_dir)
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    tmp_path = os.path.join(snapshot_dir, "embeddings.tmp.npy")
+    np.save(tmp_path, np.ascontiguousarray(embeddings, dtype="float32"))
+    os.replace(tmp_path, os.path.join(snapshot_dir, "embeddings.npy"))
+    _write_json(os.path.join(snapshot_dir, "regulations.json"), regulations)
+    _write_json(os.path.join(snapshot_dir, "passages.json"), passages)
+
+    _write_json(_pointer_path(ecfr_date, cache_dir), {
+        "version": SNAPSHOT_VERSION,
+        "snapshot": name,
+        "ecfr_date": ecfr_date,
+        "count": len(regulations)
+    })
+    return name
+
+
+def latest_snapshot(cache_dir=CACHE_DIR):
+    """Returns (regulations, passages, embeddings) of the most recent snapshot for any date, or None."""
+    if not os.path.isdir(cache_dir):
+        return None
+    dates = sorted(
+        (f[:-len(".json")] for f in os.listdir(cache_dir) if f.endswith(".json")),
+        reverse=True
+    )
+    for ecfr_date in dates:
+        snapshot = load_snapshot(ecfr_date, cache_dir)
+        if snapshot:
+            return snapshot
+    return None
+
+
+def build_embeddings(regulations, encoder, previous=None):
+    """
+    Embeds the regulations (or passages), re-using rows from a previous (items, embeddings)
+    pair whose content hash has not changed. Only new or modified items are encoded.
+    """
+    reusable = {}
+    prev_embeddings = None
+    if previous:
+        prev_regulations, prev_embeddings = previous
+        for row, reg in enumerate(prev_regulations):
+            if reg.get("hash"):
+                reusable[reg["hash"]] = row
+
+    missing = []
+    for row, reg in enumerate(regulations):
+        reg["hash"] = section_hash(reg)
+        if reg["hash"] not in reusable:
+            missing.append(row)
+
+    encoded = None
+    if missing:
+        encoded = np.asarray(
+            encoder.encode([regulation_text(regulations[row]) for row in missing]),
+            dtype="float32"
+        )
+    dimension = encoded.shape[1] if encoded is not None else prev_embeddings.shape[1]
+    embeddings = np.empty((len(regulations), dimension), dtype="float32")
+    for i, row in enumerate(missing):
+        embeddings[row] = encoded[i]
+    for row, reg in enumerate(regulations):
+        if reg["hash"] in reusable:
+            embeddings[row] = prev_embeddings[reusable[reg["hash"]]]
+
+    print(f"Encoded {len(missing)} new or changed passages, re-used {len(regulations) - len(missing)}")
+    return embeddings
+
+
+def load_or_build(ecfr_date, fetch, encoder):
+    """
+    Returns (regulations, passages, embeddings, fresh) for an eCFR date.
+    A snapshot on disk is used when present; otherwise `fetch()` is called, sections are
+    chunked into passages, changed passages are re-encoded and a new snapshot is written.
+    `fresh` is True when the corpus was fetched rather than loaded.
+    """
+    snapshot = load_snapshot(ecfr_date)
+    if snapshot:
+        regulations, passages, embeddings = snapshot
+        return regulations, passages, embeddings, False
+
+    regulations = fetch()
+    if not regulations:
+        return [], [], None, True
+    for reg in regulations:
+        reg["hash"] = section_hash(reg)
+    passages = chunk_regulations(regulations)
+    if not encoder:
+        return regulations, passages, None, True
+
+    previous = latest_snapshot()
+    embeddings = build_embeddings(passages, encoder, previous[1:] if previous else None)
+    try:
+        save_snapshot(ecfr_date, regulations, passages, embeddings)
+    except OSError as e:
+        print(f"Could not write regulation snapshot: {e}")
+    return regulations, passages, embeddings, True
@@ -0,0 +1,144 @@
+"""
+Second-stage re-ranking of retrieved passages with a local cross-encoder.
+
+The benchmark compares plain hybrid retrieval with re-ranked retrieval over a set of
+questions and reports prompt tokens and latency for both:
+
+    RERANK_ENABLED=1 python reranker.py [questions.txt]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+from token_budget import count_tokens
+
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# First-stage passages handed to the cross-encoder
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", 50))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 16))
+# Scoring stops before the batch that would overrun this, keeping first-stage order for the rest
+RERANK_LATENCY_MS = float(os.environ.get("RERANK_LATENCY_MS", 250))
+# ms-marco cross-encoders output logits; passages below this are dropped as irrelevant
+RERANK_THRESHOLD = float(os.environ.get("RERANK_THRESHOLD", -4.0))
+# Prompt tokens of passage text kept per query; 0 means no limit
+RERANK_TOKEN_BUDGET = int(os.environ.get("RERANK_TOKEN_BUDGET", 1500))
+
+SAMPLE_QUESTIONS = [
+    "What are the oxygen requirements for flights above FL250?",
+    "Fuel reserve requirements for IFR flights to an alternate",
+    "Pilot in command flight time limitations and rest requirements",
+    "Can I take off when the destination is below weather minimums?",
+    "Life rafts and survival equipment for extended overwater operations",
+    "What does 135.89 require?",
+    "Icing conditions: when is flight into known icing prohibited?",
+    "TCAS requirements for turbine aircraft with more than 10 seats",
+]
+
+
+class Reranker:
+    """
+    Scores (query, passage) pairs with a cross-encoder on CPU in batches. The model is loaded
+    on first use; calls are serialized so concurrent requests don't oversubscribe the CPU.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cutoffs = 0
+
+    def _load(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def rerank(self, query, candidates, text, latency_ms=RERANK_LATENCY_MS,
+               threshold=RERANK_THRESHOLD, token_budget=RERANK_TOKEN_BUDGET):
+        """
+        Re-orders `candidates` by cross-encoder score of `text(candidate)` against `query`.
+        Scored candidates below `threshold` are dropped, and the kept text stops at
+        `token_budget` tokens. If the latency budget runs out, candidates not yet scored follow
+        the scored ones in their first-stage order. Returns (kept candidates, stats).
+        """
+        started = time.perf_counter()
+        deadline = started + latency_ms / 1000.0
+        texts = [text(candidate) for candidate in candidates]
+        scores = []
+        with self._lock:
+            model = self._load()
+            batch_seconds = 0.0
+            for start in range(0, len(texts), self.batch_size):
+                now = time.perf_counter()
+                if scores and now + batch_seconds > deadline:
+                    break
+                batch = texts[start:start + self.batch_size]
+                scores.extend(float(s) for s in model.predict([(query, t) for t in batch], batch_size=self.batch_size))
+                batch_seconds = time.perf_counter() - now
+            self.calls += 1
+            cutoff = len(scores) < len(texts)
+            if cutoff:
+                self.cutoffs += 1
+
+        scored = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        # The best candidate is kept even below the threshold so the prompt is never left empty
+        passing = [i for i in scored if scores[i] >= threshold] or scored[:1]
+        order = passing + list(range(len(scores), len(texts)))
+        kept = []
+        tokens = 0
+        for i in order:
+            cost = count_tokens(texts[i])
+            if token_budget and kept and tokens + cost > token_budget:
+                break
+            kept.append(i)
+            tokens += cost
+        return [candidates[i] for i in kept], {
+            "candidates": len(candidates),
+            "scored": len(scores),
+            "kept": len(kept),
+            "cutoff": cutoff,
+            "tokens_in": sum(count_tokens(t) for t in texts),
+            "tokens_kept": tokens,
+            "rerank_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    def stats(self):
+        return {"model": self.model_name, "loaded": self._model is not None, "calls": self.calls, "cutoffs": self.cutoffs}
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else 0.0
+
+
+def benchmark(questions, n_results=5):
+    """Prompt tokens and latency of plain vs re-ranked retrieval, using the app's corpus and index."""
+    from app import get_relevant_regulations, format_regulations_for_context
+
+    rows = {"plain": {"tokens": [], "ms": []}, "rerank": {"tokens": [], "ms": []}}
+    for question in questions:
+        for mode, rerank in (("plain", False), ("rerank", True)):
+            started = time.perf_counter()
+            sections = get_relevant_regulations(question, n_results, rerank=rerank)
+            rows[mode]["ms"].append((time.perf_counter() - started) * 1000)
+            rows[mode]["tokens"].append(count_tokens(format_regulations_for_context(sections)))
+
+    print(f"{'mode':>7} {'tokens':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, data in rows.items():
+        print(f"{mode:>7} {statistics.mean(data['tokens']):>8.0f} {_percentile(data['ms'], 0.5):>8.1f} "
+              f"{_percentile(data['ms'], 0.95):>8.1f}")
+    plain, reranked = statistics.mean(rows["plain"]["tokens"]), statistics.mean(rows["rerank"]["tokens"])
+    print(f"prompt tokens saved: {plain - reranked:.0f} per query ({(1 - reranked / plain) * 100 if plain else 0:.0f}%), "
+          f"added latency p50: {_percentile(rows['rerank']['ms'], 0.5) - _percentile(rows['plain']['ms'], 0.5):.1f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            benchmark([line.strip() for line in f if line.strip()])
+    else:
+        benchmark(SAMPLE_QUESTIONS)
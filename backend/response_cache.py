@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ANALYSIS_CACHE_TTL = float(os.environ.get("ANALYSIS_CACHE_TTL", 1800))
+ANALYSIS_CACHE_SIZE = int(os.environ.get("ANALYSIS_CACHE_SIZE", 1024))
+# Cosine similarity above which a near-duplicate flight may re-use a cached response; unset disables it
+ANALYSIS_CACHE_SIMILARITY = os.environ.get("ANALYSIS_CACHE_SIMILARITY")
+
+
+def canonical_key(*parts):
+    """Stable hash of JSON-serializable parts; dict ordering and whitespace don't matter."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache for LLM responses. Entries may carry an embedding and a scope so that
+    `get` can serve a near-duplicate request from the same scope (e.g. same route
+    and aircraft) when its similarity clears the threshold.
+    """
+
+    def __init__(self, ttl=ANALYSIS_CACHE_TTL, maxsize=ANALYSIS_CACHE_SIZE, similarity=ANALYSIS_CACHE_SIMILARITY):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.similarity = float(similarity) if similarity else None
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, vector=None, scope=None):
+        """
+        Returns the cached value for `key`. On a miss, and if similarity lookup is enabled,
+        falls back to the closest non-expired entry in the same `scope`.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires"] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["value"]
+            if entry:
+                del self._entries[key]
+
+            similar = self._find_similar(vector, scope, now)
+            if similar is not None:
+                self.similar_hits += 1
+                return similar["value"]
+            self.misses += 1
+            return None
+
+    def _find_similar(self, vector, scope, now):
+        if self.similarity is None or vector is None:
+            return None
+        vector = np.asarray(vector, dtype='float32')
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        best, best_score = None, self.similarity
+        for entry in self._entries.values():
+            if entry["scope"] != scope or entry["vector"] is None or entry["expires"] <= now:
+                continue
+            score = float(np.dot(entry["vector"], vector))
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, key, value, vector=None, scope=None):
+        if vector is not None:
+            vector = np.asarray(vector, dtype='float32')
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "expires": time.time() + self.ttl,
+                "vector": vector,
+                "scope": scope
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,169 @@
+"""
+Offline compliance analysis for a whole flight schedule.
+
+Reads legs from a CSV (header: departure,arrival,aircraft,date,passengers[,id]) or a JSONL
+file, analyzes them with the shared-work pipeline in app.analyze_schedule and appends one
+JSON line per leg to the output. Re-running with the same output file resumes: legs already
+written are skipped.
+
+    python schedule_batch.py schedule.csv --out results.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+from response_cache import canonical_key
+
+LEG_FIELDS = ("departure", "arrival", "aircraft", "date", "passengers")
+
+
+def normalize_leg(leg):
+    """Cleans one schedule row; passengers become an int and stations upper case."""
+    leg = dict(leg)
+    leg["departure"] = (leg.get("departure") or "").strip().upper()
+    leg["arrival"] = (leg.get("arrival") or "").strip().upper()
+    leg["aircraft"] = (leg.get("aircraft") or "").strip()
+    leg["date"] = (leg.get("date") or "").strip()
+    try:
+        leg["passengers"] = int(leg.get("passengers") or 0)
+    except (TypeError, ValueError):
+        leg["passengers"] = 0
+    return leg
+
+
+def leg_key(leg):
+    """Checkpoint key: the schedule's own id if it has one, otherwise a hash of the leg."""
+    if leg.get("id"):
+        return str(leg["id"])
+    return canonical_key(*(leg.get(field) for field in LEG_FIELDS))[:16]
+
+
+def parse_schedule(text, fmt=None):
+    """Parses CSV or JSONL schedule text; the format is guessed from the first character if not given."""
+    text = text.lstrip("\ufeff")
+    fmt = fmt or ("jsonl" if text.lstrip().startswith("{") else "csv")
+    if fmt == "jsonl":
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    return [normalize_leg(row) for row in rows]
+
+
+def load_schedule(path):
+    with open(path, encoding="utf-8") as f:
+        return parse_schedule(f.read(), "jsonl" if path.endswith((".jsonl", ".json")) else None)
+
+
+def read_checkpoint(path):
+    """Keys of the legs already written to a JSONL output; a torn last line is ignored."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["leg_key"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class ResultWriter:
+    """Appends result lines as they finish, flushed one by one so a crash loses at most the current leg."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.written = 0
+        torn = os.path.exists(path) and os.path.getsize(path) and not _ends_with_newline(path)
+        self._file = open(path, "a", encoding="utf-8")
+        if torn:
+            # Terminate a line cut off by a crash so the next record starts cleanly
+            self._file.write("\n")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.written += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class BatchProgress:
+    """Counters for a schedule run, reported as legs done and legs per second."""
+
+    def __init__(self, total, skipped=0):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self.error = None
+        self.shared = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def leg_done(self, ok=True):
+        with self._lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def as_dict(self):
+        with self._lock:
+            elapsed = (self.finished or time.perf_counter()) - self.started
+            return {
+                "total": self.total,
+                "skipped": self.skipped,
+                "done": self.done,
+                "failed": self.failed,
+                "remaining": self.total - self.skipped - self.done - self.failed,
+                "elapsed_seconds": round(elapsed, 2),
+                "legs_per_second": round(self.done / elapsed, 3) if elapsed else 0.0,
+                "seconds_per_leg": round(elapsed / self.done, 3) if self.done else None,
+                "shared_work": dict(self.shared),
+                "stages": dict(self.stages),
+                "finished": self.finished is not None,
+                "error": self.error
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("schedule", help="CSV or JSONL schedule")
+    parser.add_argument("--out", default="schedule_results.jsonl", help="JSONL output, also the resume checkpoint")
+    args = parser.parse_args()
+
+    # Importing the app loads the regulation corpus, index and models once for the whole run
+    from app import analyze_schedule
+
+    legs = load_schedule(args.schedule)
+    progress = analyze_schedule(legs, args.out)
+    print(json.dumps(progress.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
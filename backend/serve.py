@@ -0,0 +1,47 @@
+"""
+Production launcher for the Flinsight API.
+
+Runs app.py under gunicorn with threaded workers. The I/O-heavy routes are async views:
+inside a request, the blocking METAR, Firestore and Gemini calls run concurrently on the
+I/O pool and embedding/FAISS work runs on a CPU pool.
+Each worker imports the app itself, after the fork, so the threads started at import
+(embedding batcher, job queue, prefetch, Firestore listener) run in the worker that uses
+them. The memory-mapped regulation snapshot is still shared through the page cache.
+
+    python serve.py                # 0.0.0.0:5000, WEB_CONCURRENCY workers x GUNICORN_THREADS threads
+"""
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class FlinsightServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+def server_options():
+    return {
+        "bind": os.environ.get("BIND", "0.0.0.0:5000"),
+        "workers": int(os.environ.get("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count()))),
+        "worker_class": "gthread",
+        "threads": int(os.environ.get("GUNICORN_THREADS", 64)),
+        # Gemini calls can take tens of seconds
+        "timeout": int(os.environ.get("GUNICORN_TIMEOUT", 180)),
+        "keepalive": 5,
+        "accesslog": "-",
+    }
+
+
+if __name__ == "__main__":
+    FlinsightServer(server_options()).run()
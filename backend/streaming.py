@@ -0,0 +1,103 @@
+import json
+import re
+
+from flask import Response, stream_with_context
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+def sse(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def event_stream(generator):
+    """Wraps an event generator in a text/event-stream response that proxies won't buffer."""
+    return Response(
+        stream_with_context(generator),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def chunk_text(chunk):
+    # Gemini raises on .text for chunks that only carry safety/finish metadata
+    try:
+        return chunk.text
+    except (ValueError, AttributeError):
+        return ""
+
+
+class JsonSectionParser:
+    """
+    Watches a JSON object being streamed token by token and reports each top-level key
+    in `keys` as soon as its value is complete, so sections can be emitted early.
+    A scanner tracks nesting and string state (including escapes) across chunks, so only
+    real top-level keys count: text like `"key":` inside a string value is ignored.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.buffer = ""
+        self.emitted = set()
+        self._decoder = json.JSONDecoder()
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._expect_key = False
+        self._key = None
+        # key -> offset in buffer where its value starts
+        self._pending = {}
+
+    def feed(self, text):
+        """Adds streamed text; returns [(key, value)] for sections completed by it."""
+        self.buffer += text
+        self._scan()
+        completed = []
+        for key, start in list(self._pending.items()):
+            start = _WHITESPACE.match(self.buffer, start).end()
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, start)
+            except ValueError:
+                continue
+            if end >= len(self.buffer) and not isinstance(value, (dict, list, str)):
+                # A number or literal at the end of the buffer may still be growing
+                continue
+            del self._pending[key]
+            self.emitted.add(key)
+            completed.append((key, value))
+        return completed
+
+    def _scan(self):
+        buffer = self.buffer
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._expect_key and self._stack == ["{"]:
+                        self._key = json.loads(buffer[self._string_start:pos + 1])
+                        self._expect_key = False
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in "{[":
+                self._stack.append(char)
+                self._expect_key = self._stack == ["{"]
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+            elif char == "," and self._stack == ["{"]:
+                self._expect_key = True
+            elif char == ":" and self._stack == ["{"] and self._key is not None:
+                if self._key in self.keys and self._key not in self.emitted:
+                    self._pending.setdefault(self._key, pos + 1)
+                self._key = None
+        self._pos = len(buffer)
@@ -1,7 +1,17 @@
+import codecs
+import time
+from html.parser import HTMLParser
+
 import requests
 from bs4 import BeautifulSoup
 
-def fetch_and_parse_regulations(url):
+def fetch_and_parse_regulations(url, streaming=False, timings=None):
+    if streaming:
+        try:
+            return list(iter_regulations(url, timings=timings))
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching data from eCFR: {e}")
+            return []
     try:
         # Send the GET request
         response = requests.get(url)
@@ -56,6 +66,161 @@ def fetch_and_parse_regulations(url):
 from datetime import datetime
 import re
 
+# Elements that never get an end tag, so they must not be pushed on the parser stack
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class SectionParser(HTMLParser):
+    """
+    Incremental eCFR parser. Feed it chunks of HTML and collect finished regulations
+    from `completed`; only the section currently being parsed is held in memory.
+    Each nested div contributes only its own text, so content is not duplicated.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.completed = []
+        self.timings = []
+        self.network_wait = 0.0
+        self._stack = []
+        self._section = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_ELEMENTS:
+            return
+        classes = (dict(attrs).get("class") or "").split()
+        self._stack.append(tag)
+        depth = len(self._stack)
+
+        if self._section is None:
+            if tag == "div" and "section" in classes:
+                self._section = {
+                    "depth": depth,
+                    "heading": [],
+                    "lines": [],
+                    "divs": [],
+                    "citation": None,
+                    "citation_depth": None,
+                    "heading_depth": None,
+                    "started": time.perf_counter(),
+                    "wait": self.network_wait
+                }
+            return
+
+        section = self._section
+        if tag == "h4" and section["heading_depth"] is None and not section["heading"]:
+            section["heading_depth"] = depth
+        if "citation" in classes and section["citation_depth"] is None and section["citation"] is None:
+            section["citation_depth"] = depth
+            section["citation"] = []
+        if tag == "div":
+            self._flush_div()
+            section["divs"].append([])
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS or tag not in self._stack:
+            return
+        # Pop up to the matching tag, closing anything left open by sloppy markup
+        while self._stack:
+            depth = len(self._stack)
+            open_tag = self._stack.pop()
+            self._close(open_tag, depth)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        section = self._section
+        if section is None:
+            return
+        if section["heading_depth"] is not None:
+            section["heading"].append(data)
+        if section["citation_depth"] is not None:
+            section["citation"].append(data)
+        if section["divs"]:
+            section["divs"][-1].append(data)
+
+    def _flush_div(self):
+        divs = self._section["divs"]
+        if divs and divs[-1]:
+            text = "".join(divs[-1]).strip()
+            if text:
+                self._section["lines"].append(text)
+            divs[-1] = []
+
+    def _close(self, tag, depth):
+        section = self._section
+        if section is None:
+            return
+        if depth == section["heading_depth"]:
+            section["heading_depth"] = None
+        if depth == section["citation_depth"]:
+            section["citation_depth"] = None
+        if depth == section["depth"]:
+            self._finish_section()
+        elif tag == "div":
+            self._flush_div()
+            section["divs"].pop()
+
+    def _finish_section(self):
+        section = self._section
+        self._section = None
+        idtitle = "".join(section["heading"]).strip()
+        parts = idtitle.split(" ")
+        if len(parts) < 2:
+            return
+
+        regulation = {}
+        regulation['id'] = parts[1]
+        regulation['title'] = " ".join(parts[2:])
+        regulation['content'] = "\n".join(section["lines"])
+        regulation['category'] = "regulation"
+        if section["citation"] is not None:
+            date_text = "".join(section["citation"]).strip()
+            regulation['date'] = clean_and_convert_date(" ".join(date_text.split()[-3:]))
+        else:
+            regulation['date'] = "Unknown"
+        self.completed.append(regulation)
+
+        # Wall time spent on this section, excluding time waiting on the network
+        elapsed = time.perf_counter() - section["started"] - (self.network_wait - section["wait"])
+        self.timings.append((regulation['id'], elapsed))
+
+
+def iter_regulations(url, chunk_size=64 * 1024, timings=None, session=None):
+    """
+    Streams the eCFR response in chunks through SectionParser and yields one regulation
+    dict per div.section as soon as it is complete, so memory stays flat for large parts.
+    If `timings` is a list, (section id, seconds) pairs are appended to it.
+    A failed request, an error status or a connection dropped mid-stream raises
+    requests.exceptions.RequestException, so a cut-off part is never mistaken for a short one.
+    """
+    http = session or requests
+    with http.get(url, stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        parser = SectionParser()
+        chunks = response.iter_content(chunk_size=chunk_size)
+        while True:
+            waited = time.perf_counter()
+            chunk = next(chunks, None)
+            parser.network_wait += time.perf_counter() - waited
+            if chunk is None:
+                break
+            parser.feed(decoder.decode(chunk))
+            yield from _drain(parser, timings)
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        yield from _drain(parser, timings)
+
+
+def _drain(parser, timings):
+    if timings is not None:
+        timings.extend(parser.timings)
+    parser.timings = []
+    completed, parser.completed = parser.completed, []
+    yield from completed
+
 def clean_and_convert_date(date_str):
     # Remove any unwanted characters (like the closing bracket) and extra spaces
     date_str = re.sub(r'[^\w\s,]', '', date_str).strip()
@@ -78,7 +243,12 @@ def clean_and_convert_date(date_str):
 if __name__ == "__main__":
     # Example usage
     url = 'https://www.ecfr.gov/api/renderer/v1/content/enhanced/2025-03-12/title-14?chapter=I&subchapter=G&part=135'
-    regulations = fetch_and_parse_regulations(url)
+    timings = []
+    regulations = fetch_and_parse_regulations(url, streaming=True, timings=timings)
     for regulation in regulations:
         print(f"ID: {regulation['id']}, Title: {regulation['title']}, Content: {regulation['content']}")
-    print(regulations)
\ No newline at end of file
+    print(regulations)
+    slowest = sorted(timings, key=lambda t: t[1], reverse=True)[:10]
+    print(f"Parsed {len(timings)} sections in {sum(t for _, t in timings):.3f}s, slowest:")
+    for section_id, seconds in slowest:
+        print(f"  {section_id}: {seconds * 1000:.2f} ms")
\ No newline at end of file
@@ -0,0 +1,46 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Records wall time per named stage of a request; safe to use from worker threads."""
+
+    def __init__(self):
+        self.stages = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    async def measure(self, name, awaitable):
+        """Awaits `awaitable` and records its duration, for stages run with asyncio.gather."""
+        with self.stage(name):
+            return await awaitable
+
+    def mark(self, name):
+        """Records the time since the timer started under `name`, once (e.g. time to first byte)."""
+        with self._lock:
+            self.stages.setdefault(name, time.perf_counter() - self._started)
+
+    def total(self):
+        return time.perf_counter() - self._started
+
+    def as_dict(self):
+        """Stage durations in milliseconds, plus the total so far."""
+        with self._lock:
+            timings = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        timings["total"] = round(self.total() * 1000, 1)
+        return timings
+
+    def server_timing(self):
+        """Value for a Server-Timing response header, e.g. 'metar;dur=120.5, total;dur=900.2'."""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+from bisect import bisect_left
+
+# Tokens of regulation text packed into one prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2000))
+# Shortest cut-down passage worth including when the budget is nearly spent
+MIN_PASSAGE_TOKENS = 32
+# Upper bounds of the token histogram buckets; larger counts land in +Inf
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Words split into pieces of at most 6 characters plus single punctuation marks: a close,
+# slightly high estimate of Gemini's SentencePiece counts without a count_tokens round trip
+_TOKEN_RE = re.compile(r"\w{1,6}|[^\w\s]")
+
+
+def count_tokens(text):
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+def truncate(text, max_tokens):
+    """Cuts `text` after `max_tokens` tokens, marking the cut with an ellipsis."""
+    if max_tokens <= 1:
+        return ""
+    for n, match in enumerate(_TOKEN_RE.finditer(text)):
+        if n == max_tokens - 1:
+            return text[:match.start()].rstrip() + "…"
+    return text
+
+
+def compact(text):
+    """Collapses whitespace runs, including the indentation and blank lines eCFR text carries."""
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def pack_sections(sections, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Packs the matched passages of ranked sections into at most `budget` tokens as compact
+    "[id] title: text" lines. Passages are taken breadth first, the best passage of every
+    section before any section's second, so the top sections all make it in before the
+    budget runs out. Sections carrying a fused `score` are taken in score order.
+    Returns (context text, ids of the sections included, tokens used).
+    """
+    if any("score" in section for section in sections):
+        sections = sorted(sections, key=lambda section: section.get("score", 0.0), reverse=True)
+    queues = [[compact(p) for p in (section.get("matched_passages") or [section.get("content", "")]) if compact(p)]
+              for section in sections]
+    packed = {}
+    used = 0
+    depth = 0
+    while any(depth < len(queue) for queue in queues):
+        for position, queue in enumerate(queues):
+            if depth >= len(queue):
+                continue
+            section = sections[position]
+            header = f"[{section['id']}] {compact(section.get('title'))}: " if position not in packed else ""
+            text = queue[depth]
+            cost = count_tokens(header) + count_tokens(text)
+            if used + cost > budget:
+                # A section's first passage is cut to fit rather than skipped for lower-ranked ones
+                room = budget - used - count_tokens(header)
+                if not header or room < MIN_PASSAGE_TOKENS:
+                    continue
+                text = truncate(text, room)
+                cost = count_tokens(header) + count_tokens(text)
+            packed.setdefault(position, [header]).append(text)
+            used += cost
+        depth += 1
+    lines = ["".join([parts[0], " ".join(parts[1:])]) for _, parts in sorted(packed.items())]
+    return "\n".join(lines), [sections[position]["id"] for position in sorted(packed)], used
+
+
+def _response_text(response):
+    try:
+        return response.text
+    except Exception:
+        return ""
+
+
+class TokenStats:
+    """Per-endpoint histograms of prompt and response tokens for every Gemini call."""
+
+    def __init__(self, buckets=TOKEN_BUCKETS):
+        self.buckets = buckets
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, prompt, response=None, response_text=None):
+        """
+        Records one call. Counts come from the response's usage metadata when the SDK provides
+        it, otherwise from the local tokenizer. Returns (prompt tokens, response tokens).
+        """
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or count_tokens(prompt)
+        if response_text is None and response is not None:
+            response_text = _response_text(response)
+        response_tokens = getattr(usage, "candidates_token_count", None) or count_tokens(response_text)
+        with self._lock:
+            entry = self._data.setdefault(endpoint, {
+                "calls": 0,
+                "prompt": [0] * (len(self.buckets) + 1), "prompt_sum": 0,
+                "response": [0] * (len(self.buckets) + 1), "response_sum": 0
+            })
+            entry["calls"] += 1
+            entry["prompt"][bisect_left(self.buckets, prompt_tokens)] += 1
+            entry["prompt_sum"] += prompt_tokens
+            entry["response"][bisect_left(self.buckets, response_tokens)] += 1
+            entry["response_sum"] += response_tokens
+        return prompt_tokens, response_tokens
+
+    def summary(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "calls": entry["calls"],
+                    "prompt_tokens_mean": round(entry["prompt_sum"] / entry["calls"], 1),
+                    "response_tokens_mean": round(entry["response_sum"] / entry["calls"], 1),
+                    "prompt_tokens_total": entry["prompt_sum"],
+                    "response_tokens_total": entry["response_sum"]
+                }
+                for endpoint, entry in self._data.items()
+            }
+
+    def prometheus(self):
+        """Histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind in ("prompt", "response"):
+                name = f"flinsight_llm_{kind}_tokens"
+                lines.append(f"# HELP {name} Gemini {kind} tokens per call")
+                lines.append(f"# TYPE {name} histogram")
+                for endpoint, entry in sorted(self._data.items()):
+                    cumulative = 0
+                    for bound, count in zip(list(self.buckets) + ["+Inf"], entry[kind]):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {entry[kind + "_sum"]}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {entry["calls"]}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,142 @@
+import os
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+# Tunables, overridable per deployment
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+PQ_SUBQUANTIZERS = int(os.environ.get("PQ_SUBQUANTIZERS", 48))  # must divide the dimension
+PQ_BITS = 8
+
+
+def _ivf_lists(n_vectors):
+    # Roughly 4 * sqrt(n) lists, while keeping ~39 training points per centroid
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+
+def make_index(kind, dimension, n_vectors=0):
+    """
+    Creates an empty index of the given kind. Every index maps ids to row numbers in the
+    regulation list. IVF-PQ falls back to flat when there are too few vectors to train it.
+    """
+    if kind == "hnsw":
+        inner = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap(inner)
+    if kind == "ivfpq":
+        if n_vectors < 2 ** PQ_BITS * 39 or dimension % PQ_SUBQUANTIZERS:
+            print(f"Not enough vectors ({n_vectors}) to train IVF-PQ, using a flat index")
+            return make_index("flat", dimension)
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, _ivf_lists(n_vectors), PQ_SUBQUANTIZERS, PQ_BITS)
+        index.nprobe = IVF_NPROBE
+        return index
+    if kind != "flat":
+        print(f"Unknown index type '{kind}', using a flat index")
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+
+def build_index(kind, embeddings):
+    """Creates, trains (if needed) and fills an index with row numbers as ids."""
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    index = make_index(kind, embeddings.shape[1], embeddings.shape[0])
+    if not index.is_trained:
+        started = time.perf_counter()
+        index.train(embeddings)
+        print(f"Trained {kind} index on {embeddings.shape[0]} vectors in {time.perf_counter() - started:.2f}s")
+    index.add_with_ids(embeddings, np.arange(embeddings.shape[0], dtype='int64'))
+    return index
+
+
+def index_path(directory, kind):
+    return os.path.join(directory, f"index-{kind}.faiss")
+
+
+def load_or_build_index(kind, embeddings, directory=None):
+    """
+    Loads a persisted index from `directory` if it matches the embeddings, otherwise builds
+    one and writes it there so other workers and restarts can skip training.
+    """
+    path = index_path(directory, kind) if directory else None
+    if path and os.path.exists(path):
+        try:
+            index = faiss.read_index(path)
+            if index.ntotal == embeddings.shape[0]:
+                set_search_params(index)
+                return index
+        except RuntimeError as e:
+            print(f"Could not read index {path}: {e}")
+
+    index = build_index(kind, embeddings)
+    if path:
+        try:
+            faiss.write_index(index, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except (RuntimeError, OSError) as e:
+            print(f"Could not write index {path}: {e}")
+    return index
+
+
+def set_search_params(index):
+    """Search-time parameters are not always persisted, so re-apply them after loading."""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+
+
+def benchmark(embeddings, queries, k=5, kinds=INDEX_TYPES):
+    """
+    Measures recall@k against the exact flat index and per-query latency for each index kind.
+    Returns {kind: {"recall": float, "latency_ms": float, "build_s": float}}.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    results = {}
+    truth = None
+    for kind in ("flat",) + tuple(k_ for k_ in kinds if k_ != "flat"):
+        started = time.perf_counter()
+        index = build_index(kind, embeddings)
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for query in queries:
+            index.search(query[None, :], k)
+        latency_ms = (time.perf_counter() - started) / len(queries) * 1000
+        _, found = index.search(queries, k)
+
+        if truth is None:
+            truth = found
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        results[kind] = {
+            "recall": hits / float(truth.size),
+            "latency_ms": latency_ms,
+            "build_s": build_s
+        }
+    return results
+
+
+if __name__ == "__main__":
+    from regulation_store import latest_snapshot
+
+    snapshot = latest_snapshot()
+    if snapshot:
+        corpus = np.asarray(snapshot[2], dtype='float32')
+    else:
+        print("No regulation snapshot found, benchmarking on random vectors")
+        corpus = np.random.rand(20000, 384).astype('float32')
+
+    # Perturbed corpus rows stand in for real queries
+    rng = np.random.default_rng(0)
+    sample = corpus[rng.choice(corpus.shape[0], size=min(200, corpus.shape[0]), replace=False)]
+    queries = sample + rng.normal(scale=0.05, size=sample.shape).astype('float32')
+
+    for kind, stats in benchmark(corpus, queries, k=5).items():
+        print(f"{kind:6s} recall@5={stats['recall']:.3f} latency={stats['latency_ms']:.3f} ms build={stats['build_s']:.2f}s")
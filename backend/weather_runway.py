@@ -1,7 +1,13 @@
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import os
+import re
+import threading
+import time
 
 env_path = os.path.join(os.path.dirname(__file__), "..", ".env.local")
 
@@ -9,17 +15,48 @@ env_path = os.path.join(os.path.dirname(__file__), "..", ".env.local")
 load_dotenv(env_path)
 api_key = os.environ.get("METAR_API_KEY", "your-api-key")
 
-def get_metar_avwx(station, token = api_key):
+# Routine METARs are issued hourly; a new one is expected about an hour after the last observation
+METAR_INTERVAL = timedelta(minutes=60)
+# Allowance for the report to reach AVWX after its observation time
+METAR_PUBLISH_DELAY = timedelta(minutes=5)
+# SPECIs are issued when conditions change quickly, so check again sooner
+SPECI_TTL = timedelta(minutes=10)
+# When the next report is overdue, or the fetch failed, retry after this long
+METAR_RETRY_TTL = timedelta(minutes=2)
+METAR_MIN_TTL = timedelta(seconds=60)
+REQUEST_TIMEOUT = (5, 15)  # connect, read
+
+def _make_session():
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=["GET"], respect_retry_after_header=True)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+    })
+    return session
+
+# Keep-alive connection pool shared by every AVWX call
+session = _make_session()
+
+_metar_cache = {}
+_inflight = {}
+_cache_lock = threading.Lock()
+metar_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+def fetch_metar_avwx(station, token = api_key):
     """
     Fetches the METAR for a given station (e.g., KJFK or EGLL) using the AVWX REST API.
     Returns the parsed JSON data or None if there's an error.
     """
     url = f"https://avwx.rest/api/metar/{station}"
     params = {"token": token}
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-    }
-    response = requests.get(url, params=params, headers=headers)
+    try:
+        response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data for {station}: {e}")
+        return None
     if response.status_code != 200:
         print(f"Error fetching data for {station} (HTTP {response.status_code})")
         return None
@@ -30,13 +67,430 @@ def get_metar_avwx(station, token = api_key):
         return None
     return data
 
+def observation_time(metar_data):
+    """The report's observation time (`time.dt`) as a datetime, or None."""
+    try:
+        return datetime.fromisoformat(metar_data["time"]["dt"].replace("Z", "+00:00"))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+def metar_expiry(metar_data, now=None):
+    """
+    When a cached METAR should be refreshed: shortly after the next routine report is due,
+    based on the report's observation time (`time.dt`), sooner for a SPECI.
+    """
+    now = now or datetime.now(timezone.utc)
+    observed = observation_time(metar_data)
+    if observed is None:
+        return now + METAR_RETRY_TTL
+
+    expires = observed + METAR_INTERVAL + METAR_PUBLISH_DELAY
+    if (metar_data.get("raw") or "").startswith("SPECI") or metar_data.get("type") == "SPECI":
+        expires = min(expires, now + SPECI_TTL)
+    if expires <= now:
+        # The next report is overdue; poll again soon rather than serving a stale one for long
+        return now + METAR_RETRY_TTL
+    return max(expires, now + METAR_MIN_TTL)
+
+def get_metar_avwx(station, token = api_key):
+    """
+    Cached METAR lookup. Reports are kept until the next one is expected, and concurrent
+    misses for the same station share a single upstream request.
+    """
+    station = (station or "").strip().upper()
+    now = datetime.now(timezone.utc)
+    with _cache_lock:
+        cached = _metar_cache.get(station)
+        if cached and cached[0] > now:
+            metar_cache_stats["hits"] += 1
+            return cached[1]
+        future = _inflight.get(station)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[station] = future
+            metar_cache_stats["misses"] += 1
+        else:
+            metar_cache_stats["coalesced"] += 1
+
+    if not leader:
+        return future.result()
+
+    try:
+        data = fetch_metar_avwx(station, token)
+        with _cache_lock:
+            if data is None:
+                metar_cache_stats["errors"] += 1
+            _metar_cache[station] = (metar_expiry(data), data)
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _cache_lock:
+            _inflight.pop(station, None)
+
+# Upper bound on simultaneous AVWX requests from one bulk lookup
+BULK_CONCURRENCY = int(os.environ.get("METAR_BULK_CONCURRENCY", 8))
+
+def get_metars(stations, max_workers=BULK_CONCURRENCY):
+    """
+    Fetches METARs for many stations concurrently (at most `max_workers` at a time).
+    Stations are de-duplicated and cached reports are served without a request.
+    Returns {station: metar data or None}.
+    """
+    unique = list(dict.fromkeys(s.strip().upper() for s in stations if s and s.strip()))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique)), thread_name_prefix="metar") as pool:
+        return dict(zip(unique, pool.map(get_metar_avwx, unique)))
+
+def metar_cache_info():
+    with _cache_lock:
+        return dict(metar_cache_stats, stations=len(_metar_cache))
+
+def _bucket(value, step):
+    if not isinstance(value, (int, float)):
+        return None
+    return int(round(value / step) * step)
+
+def bucket_metar(metar_data):
+    """
+    Coarse, hashable summary of a METAR for cache keys: two reports that only differ by a few
+    knots or degrees land in the same bucket, while a change in flight rules, weather or
+    ceiling does not.
+    """
+    if not metar_data:
+        return None
+    ceiling = None
+    for cloud in metar_data.get("clouds") or []:
+        if cloud.get("type") in ("BKN", "OVC", "VV") and cloud.get("altitude") is not None:
+            ceiling = cloud["altitude"]
+            break
+    return {
+        "flight_rules": metar_data.get("flight_rules"),
+        "wind_direction": _bucket((metar_data.get("wind_direction") or {}).get("value"), 30),
+        "wind_speed": _bucket((metar_data.get("wind_speed") or {}).get("value"), 5),
+        "wind_gust": _bucket((metar_data.get("wind_gust") or {}).get("value"), 5),
+        "visibility": _bucket((metar_data.get("visibility") or {}).get("value"), 1),
+        "temperature": _bucket((metar_data.get("temperature") or {}).get("value"), 5),
+        "ceiling": _bucket(ceiling, 5),
+        "wx": sorted(code.get("repr") for code in metar_data.get("wx_codes") or [] if code.get("repr"))
+    }
+
+# --- Local METAR/SPECI decoder ---------------------------------------------------------
+# Produces the same fields as AVWX (time.dt, wind_*, visibility, temperature, clouds, ...)
+# so get_from_metar and bucket_metar work on locally decoded reports.
+
+_STATION_RE = re.compile(r"^[A-Z][A-Z0-9]{3}$")
+_TIME_RE = re.compile(r"^(\d{2})(\d{2})(\d{2})Z$")
+_WIND_RE = re.compile(r"^(\d{3}|VRB|///)(\d{2,3}|//)(?:G(\d{2,3}))?(KT|MPS|KMH)$")
+_WIND_VAR_RE = re.compile(r"^(\d{3})V(\d{3})$")
+_VIS_METERS_RE = re.compile(r"^(\d{4})(NDV|[NSEW]{1,2})?$")
+_VIS_SM_RE = re.compile(r"^([PM])?(\d+)?(?:(\d)/(\d{1,2}))?SM$")
+_RVR_RE = re.compile(r"^R(\d{2}[LCR]?)/([PM])?(\d{4})(?:V([PM])?(\d{4}))?(FT)?([UDN])?$")
+_RUNWAY_STATE_RE = re.compile(r"^R(\d{2}[LCR]?)/(?:(CLRD)(\d\d|//)|(\d|/)(\d|/)(\d\d|//)(\d\d|//))$")
+_WX_RE = re.compile(
+    r"^(-|\+|VC)?(MI|PR|BC|DR|BL|SH|TS|FZ)?"
+    r"((?:DZ|RA|SN|SG|IC|PL|GR|GS|UP)*)(BR|FG|FU|VA|DU|SA|HZ|PY|PO|SQ|FC|SS|DS)?$"
+)
+_CLOUD_RE = re.compile(r"^(FEW|SCT|BKN|OVC|VV)(\d{3}|///)(CB|TCU|///)?$")
+_TEMP_RE = re.compile(r"^(M?\d{2}|//)/(M?\d{2}|//)?$")
+_ALTIMETER_RE = re.compile(r"^([AQ])(\d{4})$")
+_SKY_CLEAR = {"SKC", "CLR", "NSC", "NCD"}
+_TREND_MARKERS = {"RMK", "TEMPO", "BECMG", "NOSIG"}
+METERS_PER_SM = 1609.344
+
+
+def _value(repr_=None, value=None):
+    return {"repr": repr_, "value": value}
+
+
+def _temperature(token):
+    if token in (None, "//"):
+        return None
+    return -int(token[1:]) if token.startswith("M") else int(token)
+
+
+def _observation_time(day, hour, minute, reference):
+    # METARs only carry day-of-month; take the month/year from the reference time
+    observed = reference.replace(day=1, hour=hour, minute=minute, second=0, microsecond=0)
+    if day > reference.day:
+        observed = (observed - timedelta(days=1)).replace(day=1)
+    try:
+        return observed.replace(day=day)
+    except ValueError:
+        return None
+
+
+def _flight_rules(visibility_sm, ceiling_ft):
+    visibility_sm = 10.0 if visibility_sm is None else visibility_sm
+    ceiling_ft = 99999 if ceiling_ft is None else ceiling_ft
+    if visibility_sm < 1 or ceiling_ft < 500:
+        return "LIFR"
+    if visibility_sm < 3 or ceiling_ft < 1000:
+        return "IFR"
+    if visibility_sm <= 5 or ceiling_ft <= 3000:
+        return "MVFR"
+    return "VFR"
+
+
+def decode_metar(raw, reference=None):
+    """
+    Decodes a raw METAR/SPECI into an AVWX-shaped dict: station, time, wind, visibility, RVR,
+    weather, clouds, temperature/dewpoint, altimeter and runway-state groups. Remarks and trend
+    groups are kept as text. Returns None if the report has no station.
+    """
+    reference = reference or datetime.now(timezone.utc)
+    tokens = raw.split()
+    data = {
+        "raw": raw.strip(),
+        "type": "METAR",
+        "station": None,
+        "time": {"repr": None, "dt": None},
+        "wind_direction": _value(),
+        "wind_speed": _value(),
+        "wind_gust": _value(),
+        "wind_variable_direction": [],
+        "visibility": _value(),
+        "runway_visibility": [],
+        "wx_codes": [],
+        "clouds": [],
+        "temperature": _value(),
+        "dewpoint": _value(),
+        "altimeter": _value(),
+        "runway_states": [],
+        "remarks": "",
+        "units": {"wind_speed": "kt", "visibility": "sm", "altimeter": "inHg", "altitude": "ft", "temperature": "C"},
+    }
+
+    i = 0
+    if tokens and tokens[0] in ("METAR", "SPECI"):
+        data["type"] = tokens[0]
+        i = 1
+    while i < len(tokens) and tokens[i] == "COR":
+        i += 1
+    if i >= len(tokens) or not _STATION_RE.match(tokens[i]):
+        return None
+    data["station"] = tokens[i]
+    i += 1
+
+    visibility_sm = None
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _TREND_MARKERS:
+            data["remarks"] = " ".join(tokens[i:])
+            break
+        match = _TIME_RE.match(token)
+        if match and data["time"]["dt"] is None:
+            observed = _observation_time(int(match[1]), int(match[2]), int(match[3]), reference)
+            data["time"] = {"repr": token, "dt": observed.isoformat().replace("+00:00", "Z") if observed else None}
+            i += 1
+            continue
+        if token in ("AUTO", "COR", "NIL"):
+            i += 1
+            continue
+
+        match = _WIND_RE.match(token)
+        if match:
+            if match[1] not in ("VRB", "///"):
+                data["wind_direction"] = _value(match[1], int(match[1]))
+            else:
+                data["wind_direction"] = _value(match[1], None)
+            speed = int(match[2]) if match[2] != "//" else None
+            gust = int(match[3]) if match[3] else None
+            if match[4] == "MPS":
+                speed = round(speed * 1.94384) if speed is not None else None
+                gust = round(gust * 1.94384) if gust is not None else None
+            elif match[4] == "KMH":
+                speed = round(speed * 0.539957) if speed is not None else None
+                gust = round(gust * 0.539957) if gust is not None else None
+            data["wind_speed"] = _value(match[2], speed)
+            if gust is not None:
+                data["wind_gust"] = _value(match[3], gust)
+            i += 1
+            continue
+        match = _WIND_VAR_RE.match(token)
+        if match:
+            data["wind_variable_direction"] = [_value(match[1], int(match[1])), _value(match[2], int(match[2]))]
+            i += 1
+            continue
+
+        if token == "CAVOK":
+            data["visibility"] = _value(token, 9999)
+            data["units"]["visibility"] = "m"
+            visibility_sm = 9999 / METERS_PER_SM
+            i += 1
+            continue
+        match = _VIS_METERS_RE.match(token)
+        if match and data["visibility"]["value"] is None:
+            data["visibility"] = _value(token, int(match[1]))
+            data["units"]["visibility"] = "m"
+            visibility_sm = int(match[1]) / METERS_PER_SM
+            i += 1
+            continue
+        # Statute-mile visibility may be split across tokens, e.g. "1 1/2SM"
+        if token.isdigit() and i + 1 < len(tokens) and re.match(r"^\d/\d{1,2}SM$", tokens[i + 1]):
+            token = f"{token}{tokens[i + 1]}"
+            i += 1
+        match = _VIS_SM_RE.match(token)
+        if match and (match[2] or match[3]):
+            value = float(match[2] or 0)
+            if match[3]:
+                value += int(match[3]) / int(match[4])
+            data["visibility"] = _value(token, value)
+            visibility_sm = value
+            i += 1
+            continue
+
+        match = _RVR_RE.match(token)
+        if match:
+            rvr = {
+                "repr": token,
+                "runway": match[1],
+                "visibility": int(match[3]),
+                "variable_visibility": int(match[5]) if match[5] else None,
+                "modifier": match[2],
+                "trend": match[7],
+                "units": "ft" if match[6] else "m",
+            }
+            data["runway_visibility"].append(rvr)
+            i += 1
+            continue
+        match = _RUNWAY_STATE_RE.match(token)
+        if match:
+            if match[2]:
+                state = {"repr": token, "runway": match[1], "cleared": True,
+                         "deposit": None, "extent": None, "depth": None, "friction": match[3]}
+            else:
+                state = {"repr": token, "runway": match[1], "cleared": False,
+                         "deposit": match[4], "extent": match[5], "depth": match[6], "friction": match[7]}
+            data["runway_states"].append(state)
+            i += 1
+            continue
+
+        if token in _SKY_CLEAR:
+            i += 1
+            continue
+        match = _CLOUD_RE.match(token)
+        if match:
+            altitude = int(match[2]) if match[2] != "///" else None
+            data["clouds"].append({
+                "repr": token,
+                "type": match[1],
+                "altitude": altitude,
+                "modifier": match[3] if match[3] != "///" else None
+            })
+            i += 1
+            continue
+
+        match = _TEMP_RE.match(token)
+        if match:
+            data["temperature"] = _value(match[1], _temperature(match[1]))
+            data["dewpoint"] = _value(match[2], _temperature(match[2]))
+            i += 1
+            continue
+        match = _ALTIMETER_RE.match(token)
+        if match:
+            if match[1] == "A":
+                data["altimeter"] = _value(token, int(match[2]) / 100)
+            else:
+                data["altimeter"] = _value(token, int(match[2]))
+                data["units"]["altimeter"] = "hPa"
+            i += 1
+            continue
+
+        match = _WX_RE.match(token)
+        if match and (match[3] or match[4] or match[2] == "TS"):
+            data["wx_codes"].append({"repr": token, "value": token})
+        i += 1
+
+    ceiling = None
+    for cloud in data["clouds"]:
+        if cloud["type"] in ("BKN", "OVC", "VV") and cloud["altitude"] is not None:
+            ceiling = cloud["altitude"] * 100
+            break
+    data["flight_rules"] = _flight_rules(visibility_sm, ceiling)
+    return data
+
+
+def decode_metar_cycle(text, reference=None):
+    """
+    Decodes a NOAA METAR cycle file (a timestamp line followed by one report per station)
+    into {station: decoded report}. Later reports for a station replace earlier ones.
+    """
+    reports = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0].isdigit():
+            continue
+        decoded = decode_metar(line, reference)
+        if decoded:
+            reports[decoded["station"]] = decoded
+    return reports
+
+
+NOAA_CYCLE_URL = "https://tgftp.nws.noaa.gov/data/observations/metar/cycles/{hour:02d}Z.TXT"
+
+def load_metar_cycle(hour=None):
+    """
+    Downloads the NOAA hourly METAR cycle file, decodes every report locally and seeds the
+    METAR cache with them, so those stations need no per-station AVWX call.
+    Returns the number of stations loaded.
+    """
+    now = datetime.now(timezone.utc)
+    hour = now.hour if hour is None else hour
+    try:
+        response = session.get(NOAA_CYCLE_URL.format(hour=hour), timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching METAR cycle {hour:02d}Z: {e}")
+        return 0
+    reports = decode_metar_cycle(response.text, now)
+    loaded = 0
+    with _cache_lock:
+        for station, report in reports.items():
+            cached = _metar_cache.get(station)
+            # Never replace a newer report, e.g. a SPECI fetched from AVWX after the cycle was cut
+            if cached and cached[1] and (observation_time(cached[1]) or now) >= (observation_time(report) or now):
+                continue
+            _metar_cache[station] = (metar_expiry(report, now), report)
+            loaded += 1
+    return loaded
+
+
+def benchmark_decoder(reports, repeat=5):
+    """Decodes the raw reports `repeat` times and returns reports decoded per second."""
+    reference = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for raw in reports:
+            decode_metar(raw, reference)
+    elapsed = time.perf_counter() - started
+    return len(reports) * repeat / elapsed if elapsed > 0 else float("inf")
+
+
+SAMPLE_METARS = [
+    "KJFK 121451Z 31017G28KT 10SM FEW050 SCT250 08/M09 A2990 RMK AO2 PK WND 30031/1411 SLP126",
+    "SPECI KTEB 121512Z 29012KT 1 1/2SM R06/2400V4000FT -SN BR BKN008 OVC015 M01/M03 A2985 RMK AO2",
+    "EGLL 121450Z AUTO 24015KT 200V270 9999 -RA SCT014 BKN022 11/08 Q1004 NOSIG",
+    "BIRK 121500Z 08024G36KT 3000 R01/1200N -SHSN BKN012CB M02/M04 Q0987 R01/590245",
+    "LFPG 121500Z VRB02KT CAVOK 14/06 Q1021 NOSIG",
+    "KSFO 121456Z 00000KT 1/4SM FG VV002 12/12 A3001 RMK AO2 SLP162",
+]
+
 def extract_runway_conditions(raw_text):
     """
-    Attempts to extract runway condition details from the raw METAR text.
-    Looks for the keyword "rwy" (case-insensitive) and returns a snippet.
+    Extracts runway condition details from the raw METAR text: decoded RVR and runway-state
+    groups when present, otherwise a snippet after the keyword "rwy" (case-insensitive).
     """
     if not raw_text:
         return None
+    decoded = decode_metar(raw_text)
+    if decoded and (decoded["runway_visibility"] or decoded["runway_states"]):
+        groups = decoded["runway_visibility"] + decoded["runway_states"]
+        return " ".join(group["repr"] for group in groups)
     lower_text = raw_text.lower()
     idx = lower_text.find("rwy")
     if idx != -1:
@@ -81,4 +535,15 @@ def main():
             print(f"No METAR data for {airport}.")
 
 if __name__ == "__main__":
-    main()
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        # python weather_runway.py bench [cycle file]
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], encoding="utf-8", errors="replace") as f:
+                corpus = [l.strip() for l in f if l.strip() and not l.strip()[0].isdigit()]
+        else:
+            corpus = SAMPLE_METARS * 2000
+        rate = benchmark_decoder(corpus)
+        print(f"Decoded {len(corpus)} reports: {rate:,.0f} reports/s")
+    else:
+        main()